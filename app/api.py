@@ -7,22 +7,30 @@ import tempfile
 import os
 from pathlib import Path
 import asyncio
+import hashlib
 import json
+from contextlib import asynccontextmanager
 from datetime import datetime
 from typing import Optional
 
 # Import your existing modules
-from .pdf_parser import extract_text_pages
-from .chunking import chunk_pages
-from .indexer import build_faiss_index
-from .bm25_search import build_bm25
-from .retrieval import hybrid_search
+from .corpus import ingest_pdf, lookup_document, cache_stats
+from .retrieval import hybrid_search, query_cache_stats, leg_stats, UnknownDocument
 from .summarizer import map_reduce_summarize
 from .extractive_summarizer import extractive_summarize
-from .utils import write_json
-from .config import FAISS_DIR, META_DIR
+from .models import warmup
+from .config import META_DIR, WARMUP_MODELS, PDF_SPOOL_THRESHOLD
 
-app = FastAPI(title="MedRAG Open Source API", version="2.0.0", description="Open source medical document analysis platform")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Load and warm up the embedding and cross-encoder models once per process
+    if WARMUP_MODELS:
+        print("Warming up models...")
+        await asyncio.to_thread(warmup)
+        print("Models ready")
+    yield
+
+app = FastAPI(title="MedRAG Open Source API", version="2.0.0", description="Open source medical document analysis platform", lifespan=lifespan)
 
 # Enable CORS for frontend communication
 app.add_middleware(
@@ -45,6 +53,37 @@ async def read_root():
     else:
         return HTMLResponse(content="<h1>Frontend not found</h1>", status_code=404)
 
+async def read_upload(file: UploadFile, chunk_size: int = 1024 * 1024):
+    """
+    Read an upload and hash it on the fly.
+    returns (source, sha256 hex, tmp_path): source is the PDF bytes when the upload is at most
+    PDF_SPOOL_THRESHOLD bytes (tmp_path None); larger uploads are spooled to a temp file
+    whose path is returned as both source and tmp_path.
+    """
+    digest = hashlib.sha256()
+    buffer = bytearray()
+    tmp_file = None
+    try:
+        while True:
+            block = await file.read(chunk_size)
+            if not block:
+                break
+            digest.update(block)
+            if tmp_file is None and len(buffer) + len(block) > PDF_SPOOL_THRESHOLD:
+                tmp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.pdf')
+                tmp_file.write(buffer)
+                buffer = bytearray()
+            if tmp_file is None:
+                buffer += block
+            else:
+                tmp_file.write(block)
+    finally:
+        if tmp_file is not None:
+            tmp_file.close()
+    if tmp_file is not None:
+        return tmp_file.name, digest.hexdigest(), tmp_file.name
+    return memoryview(buffer), digest.hexdigest(), None
+
 @app.post("/upload")
 async def upload_and_analyze(
     file: UploadFile = File(...), 
@@ -62,43 +101,29 @@ async def upload_and_analyze(
         if not file.filename.lower().endswith('.pdf'):
             raise HTTPException(status_code=400, detail="Only PDF files are supported")
         
-        # Create temporary file
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp_file:
-            content = await file.read()
-            tmp_file.write(content)
-            tmp_path = tmp_file.name
+        source, pdf_hash, tmp_path = await read_upload(file)
 
         try:
-            # Process the PDF
-            
-            # 1. Extract pages
-            print("Step 1: Extracting pages...")
-            pages = extract_text_pages(tmp_path)
-            if not pages:
-                raise HTTPException(status_code=400, detail="Could not extract text from PDF")
-            print(f"Extracted {len(pages)} pages")
-            
-            # 2. Chunk pages
-            print("Step 2: Chunking pages...")
-            chunks = chunk_pages(pages)
-            print(f"Created {len(chunks)} chunks")
-            
-            # 3. Persist metadata
-            print("Step 3: Persisting metadata...")
-            Path(META_DIR).mkdir(parents=True, exist_ok=True)
-            write_json(Path(META_DIR)/"chunks.json", chunks)
-            print("Metadata saved")
-            
-            # 4. Build indices
-            print("Step 4: Building indices...")
-            index, emb_model, id_map = build_faiss_index(chunks, persist=True)
-            print("FAISS index built")
-            bm25, ids = build_bm25(chunks, persist=True)
-            print("BM25 index built")
+            # 0. Ingestion cache: an identical PDF reuses its pages, chunks and index entries
+            cached = lookup_document(pdf_hash)
+            if cached:
+                document, pages, chunks = cached
+                print(f"Cache hit: document {document['doc_id']} already indexed")
+            else:
+                # Process the PDF (parsed from memory, or from the spool file for very large uploads)
+                
+                # 1-4. Stream pages -> chunks -> embedding batches into the corpus indices
+                print("Steps 1-4: Extracting, chunking and indexing (streaming)...")
+                Path(META_DIR).mkdir(parents=True, exist_ok=True)
+                document, pages, chunks = ingest_pdf(source, filename=file.filename, doc_hash=pdf_hash)
+                if document is None:
+                    raise HTTPException(status_code=400, detail="Could not extract text from PDF")
+                print(f"Extracted {len(pages)} pages, created {len(chunks)} chunks")
+                print(f"Document {document['doc_id']} indexed")
             
             # 5. Retrieve relevant chunks
             print("Step 5: Retrieving relevant chunks...")
-            retrieved = hybrid_search("Summarize full report comprehensively", META_DIR)
+            retrieved = hybrid_search("Summarize full report comprehensively", META_DIR, doc_id=document["doc_id"])
             print(f"Retrieved {len(retrieved)} chunks")
             
             # Ensure coverage
@@ -128,10 +153,14 @@ async def upload_and_analyze(
                 "success": True,
                 "summary": summary,
                 "summary_type": summary_method,
+                "doc_id": document["doc_id"],
+                "cache": {"hit": bool(cached), **cache_stats()},
                 "stats": {
                     "pages": len(pages),
                     "chunks": len(chunks),
                     "characters": sum(len(c['text']) for c in chunks),
+                    "boilerplate_chars_removed": document.get("boilerplate", {}).get("chars_removed", 0),
+                    "duplicate_chunks_skipped": document.get("dedup", {}).get("duplicate_chunks", 0),
                     "method": summary_method
                 },
                 "message": "Analysis complete! No authentication required - unlimited use available."
@@ -139,7 +168,7 @@ async def upload_and_analyze(
             
         finally:
             # Clean up temporary file
-            if os.path.exists(tmp_path):
+            if tmp_path and os.path.exists(tmp_path):
                 os.unlink(tmp_path)
             
     except HTTPException:
@@ -153,13 +182,23 @@ async def upload_and_analyze(
 
 @app.post("/search")
 async def search_endpoint(payload: dict):
-    """Search endpoint used by frontend. Expects JSON {"query": "..."} and returns matching chunks."""
+    """
+    Search endpoint used by frontend. Expects JSON {"query": "...", "doc_id": optional, "ef_search": optional}
+    and returns matching chunks, best first, each with its cross-encoder "score".
+    ef_search (search effort) trades dense recall for latency.
+    """
     try:
         query = payload.get('query', '').strip()
         if not query:
             raise HTTPException(status_code=400, detail="Query is required")
+        ef_search = payload.get('ef_search')
+        if ef_search is not None and (not isinstance(ef_search, int) or isinstance(ef_search, bool) or not 1 <= ef_search <= 4096):
+            raise HTTPException(status_code=400, detail="ef_search must be an integer between 1 and 4096")
 
-        results = hybrid_search(query, str(META_DIR))
+        try:
+            results = hybrid_search(query, str(META_DIR), doc_id=payload.get('doc_id'), ef_search=ef_search)
+        except UnknownDocument as e:
+            raise HTTPException(status_code=404, detail=str(e))
 
         # Ensure results are JSON serializable (they should be dicts loaded from metadata)
         return JSONResponse(content={"results": results})
@@ -184,6 +223,15 @@ async def health_check():
         }
     }
 
+@app.get("/stats")
+async def stats():
+    """Counters of this worker: caches (ingestion, query results, query embeddings) and dropped retrieval legs"""
+    return {
+        "ingestion_cache": cache_stats(),
+        "query_cache": query_cache_stats(),
+        "retrieval_legs": leg_stats(),
+    }
+
 @app.get("/info")
 async def app_info():
     """Application information endpoint"""
@@ -205,6 +253,7 @@ async def app_info():
             "/upload": "Upload and analyze medical documents",
             "/search": "Search through analyzed documents",
             "/health": "Health check",
+            "/stats": "Cache hit/miss and retrieval leg timeout counters",
             "/info": "Application information"
         },
         "license": "Open Source",
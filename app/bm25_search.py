@@ -1,20 +1,243 @@
-from rank_bm25 import BM25Okapi
-import os, pickle
+import numpy as np
+from scipy import sparse
+import os
 from .config import BM25_DIR
+from .utils import write_json, read_json, save_npy, top_k_indices
+from .snapshots import current_snapshot
 from pathlib import Path
 
+BM25_FORMAT_VERSION = 2
+BM25_ARRAYS = ("vocab_blob", "vocab_offsets", "indptr", "indices", "tf", "weights", "doc_len", "idf", "ids")
+
 Path(BM25_DIR).mkdir(parents=True, exist_ok=True)
 
-def build_bm25(chunks, persist=True):
+class Vocab:
+    """
+    Sorted vocabulary stored as one UTF-8 blob plus offsets, so it can be memory-mapped
+    and looked up with a binary search instead of being rebuilt into a dict on load.
+    """
+
+    def __init__(self, blob, offsets):
+        self.blob = blob
+        self.offsets = offsets
+
+    @classmethod
+    def from_terms(cls, sorted_terms):
+        encoded = [t.encode("utf-8") for t in sorted_terms]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(e) for e in encoded])
+        blob = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+        return cls(blob, offsets)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def _term(self, i):
+        return self.blob[self.offsets[i]:self.offsets[i + 1]].tobytes()
+
+    def __getitem__(self, i):
+        return self._term(i).decode("utf-8")
+
+    def lookup(self, token):
+        """Row of token in the vocabulary, or -1 when unknown."""
+        key = token.encode("utf-8")
+        lo, hi = 0, len(self)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._term(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo if lo < len(self) and self._term(lo) == key else -1
+
+class SparseBM25:
+    """
+    Okapi BM25 (same formula and idf floor as rank_bm25.BM25Okapi) backed by a
+    precomputed CSR term-document weight matrix of shape (vocab, docs).
+    A query is scored with a single sparse vector-matrix product.
+    """
+
+    def __init__(self, vocab, tf, weights, doc_len, idf, k1=1.5, b=0.75, epsilon=0.25):
+        self.vocab = vocab
+        self.tf = tf
+        self.weights = weights
+        self.doc_len = doc_len
+        self.idf = idf
+        self.k1 = k1
+        self.b = b
+        self.epsilon = epsilon
+        self.corpus_size = weights.shape[1]
+
+    @staticmethod
+    def _count(corpus, vocab, n_terms_min=0):
+        """Term-frequency matrix of corpus; unseen tokens are added to vocab in place."""
+        rows, cols = [], []
+        doc_len = np.zeros(len(corpus), dtype=np.float64)
+        for d, doc in enumerate(corpus):
+            doc_len[d] = len(doc)
+            for tok in doc:
+                rows.append(vocab.setdefault(tok, len(vocab)))
+                cols.append(d)
+        # duplicate (term, doc) entries are summed into term frequencies
+        tf = sparse.csr_matrix(
+            (np.ones(len(rows), dtype=np.float64), (np.array(rows, dtype=np.int64), np.array(cols, dtype=np.int64))),
+            shape=(max(len(vocab), n_terms_min), len(corpus)),
+        )
+        tf.sum_duplicates()
+        return tf, doc_len
+
+    @classmethod
+    def _from_counts(cls, vocab, tf, doc_len, k1, b, epsilon):
+        # rows follow the byte order of the terms so the vocabulary can be binary searched
+        terms = sorted(vocab, key=lambda t: t.encode("utf-8"))
+        tf = tf[[vocab[t] for t in terms]] if terms else tf
+        tf.sort_indices()
+
+        n_docs = tf.shape[1]
+        df = np.diff(tf.indptr).astype(np.float64)
+        idf = np.log(n_docs - df + 0.5) - np.log(df + 0.5)
+        if len(idf):
+            # floor negative idf (terms in more than half the docs) at epsilon * average idf
+            idf[idf < 0] = epsilon * idf.mean()
+
+        avgdl = doc_len.mean() if n_docs else 0.0
+        term = np.repeat(np.arange(len(terms)), np.diff(tf.indptr))
+        norm = k1 * (1 - b + b * doc_len[tf.indices] / avgdl) if n_docs else 0.0
+        weights = tf.copy()
+        weights.data = idf[term] * (tf.data * (k1 + 1) / (tf.data + norm))
+        return cls(Vocab.from_terms(terms), tf, weights, doc_len, idf, k1=k1, b=b, epsilon=epsilon)
+
+    @classmethod
+    def from_tokenized(cls, corpus, k1=1.5, b=0.75, epsilon=0.25):
+        vocab = {}
+        tf, doc_len = cls._count(corpus, vocab)
+        return cls._from_counts(vocab, tf, doc_len, k1, b, epsilon)
+
+    def extend(self, corpus):
+        """
+        Return a new index with the tokenized documents in corpus appended as new columns.
+        Existing postings are reused; only idf and the weights are recomputed (vectorized).
+        """
+        vocab = {self.vocab[i]: i for i in range(len(self.vocab))}
+        new_tf, new_len = self._count(corpus, vocab, n_terms_min=len(vocab))
+        old_tf = sparse.csr_matrix(
+            (np.asarray(self.tf.data), np.asarray(self.tf.indices),
+             np.concatenate([self.tf.indptr, np.full(len(vocab) - len(self.vocab), self.tf.indptr[-1])])),
+            shape=(len(vocab), self.corpus_size),
+        )
+        tf = sparse.hstack([old_tf, new_tf], format="csr")
+        doc_len = np.concatenate([self.doc_len, new_len])
+        return self._from_counts(vocab, tf, doc_len, self.k1, self.b, self.epsilon)
+
+    def _query_matrix(self, token_lists):
+        """One row per query with the count of each known term."""
+        rows, cols = [], []
+        for r, tokens in enumerate(token_lists):
+            for i in (self.vocab.lookup(t) for t in tokens):
+                if i >= 0:
+                    rows.append(r)
+                    cols.append(i)
+        # repeated query tokens count once per occurrence, as in BM25Okapi.get_scores
+        q = sparse.csr_matrix((np.ones(len(cols), dtype=np.float64), (rows, cols)), shape=(len(token_lists), self.weights.shape[0]))
+        q.sum_duplicates()
+        return q
+
+    def get_scores(self, tokens):
+        return (self._query_matrix([tokens]) @ self.weights).toarray().ravel()
+
+    def get_scores_many(self, token_lists):
+        """Scores of all documents for several queries with one sparse product: CSR (queries x docs)."""
+        return self._query_matrix(token_lists) @ self.weights
+
+    def top_k(self, tokens, k):
+        """Return (doc indices, scores) of the k best matching documents for the query tokens (at most k)."""
+        return self.top_k_many([tokens], k)[0]
+
+    def top_k_many(self, token_lists, k, start=0, stop=None):
+        """
+        (doc indices, scores) of the k best documents per query, optionally only among documents [start, stop).
+        Documents matching no query term (score 0) are left out, so fewer than k may be returned.
+        """
+        scores = self.get_scores_many(token_lists)
+        out = []
+        for i in range(scores.shape[0]):
+            row = scores[i].toarray().ravel()[start:stop]
+            idx = top_k_indices(row, k)
+            idx = idx[row[idx] > 0]
+            out.append((start + idx, row[idx]))
+        return out
+
+    def save(self, out_dir, ids):
+        """Persist as plain .npy arrays plus a small JSON manifest (no pickle)."""
+        out_dir = Path(out_dir)
+        out_dir.mkdir(parents=True, exist_ok=True)
+        # same index dtype scipy would pick, so loading never has to copy the mapped arrays
+        idx_dtype = np.int32 if max(self.weights.nnz, *self.weights.shape) < np.iinfo(np.int32).max else np.int64
+        arrays = {
+            "vocab_blob": self.vocab.blob,
+            "vocab_offsets": self.vocab.offsets,
+            "indptr": self.weights.indptr.astype(idx_dtype),
+            "indices": self.weights.indices.astype(idx_dtype),
+            "tf": self.tf.data.astype(np.float32),
+            "weights": self.weights.data,
+            "doc_len": self.doc_len,
+            "idf": self.idf,
+            "ids": np.array(ids, dtype=str),
+        }
+        for name in BM25_ARRAYS:
+            save_npy(out_dir / f"{name}.npy", arrays[name])
+        # manifest is written last and doubles as the version stamp of the index
+        write_json(out_dir / "bm25.json", {
+            "format_version": BM25_FORMAT_VERSION,
+            "k1": self.k1, "b": self.b, "epsilon": self.epsilon,
+            "num_docs": int(self.corpus_size), "vocab_size": len(self.vocab),
+        })
+
+    @classmethod
+    def load(cls, in_dir, mmap=True):
+        """Load a saved index; with mmap the arrays are memory-mapped read-only and shared between processes."""
+        in_dir = Path(in_dir)
+        meta = read_json(in_dir / "bm25.json")
+        assert meta["format_version"] == BM25_FORMAT_VERSION, "Unsupported BM25 index format. Rebuild the index."
+        mode = "r" if mmap else None
+        a = {name: np.load(in_dir / f"{name}.npy", mmap_mode=mode, allow_pickle=False) for name in BM25_ARRAYS}
+        shape = (meta["vocab_size"], meta["num_docs"])
+        # tf and weights share the same sparsity structure
+        weights = sparse.csr_matrix((a["weights"], a["indices"], a["indptr"]), shape=shape, copy=False)
+        tf = sparse.csr_matrix((a["tf"], a["indices"], a["indptr"]), shape=shape, copy=False)
+        bm25 = cls(Vocab(a["vocab_blob"], a["vocab_offsets"]), tf, weights, a["doc_len"], a["idf"],
+                   k1=meta["k1"], b=meta["b"], epsilon=meta["epsilon"])
+        return bm25, a["ids"]
+
+def build_bm25(chunks, persist=True, bm25_dir=BM25_DIR):
+    tokenized = [c["text"].split() for c in chunks]
+    bm25 = SparseBM25.from_tokenized(tokenized)
+    ids = [c["chunk_id"] for c in chunks]
+    if persist:
+        bm25.save(bm25_dir, ids)
+    return bm25, ids
+
+def add_to_bm25(chunks, persist=True, bm25_dir=BM25_DIR, base_dir=None):
+    """
+    Append chunks as new documents to the persisted BM25 index in base_dir (default: bm25_dir;
+    created if missing) and write the result to bm25_dir.
+    """
+    base_dir = Path(base_dir or bm25_dir)
     tokenized = [c["text"].split() for c in chunks]
-    bm25 = BM25Okapi(tokenized)
+    if (base_dir/"bm25.json").exists():
+        # load into memory: the files may be about to be overwritten
+        base, base_ids = SparseBM25.load(base_dir, mmap=False)
+        bm25 = base.extend(tokenized)
+        ids = [str(i) for i in base_ids] + [c["chunk_id"] for c in chunks]
+    else:
+        bm25 = SparseBM25.from_tokenized(tokenized)
+        ids = [c["chunk_id"] for c in chunks]
     if persist:
-        with open(Path(BM25_DIR)/"bm25.pkl", "wb") as f:
-            pickle.dump({"bm25":bm25, "ids":[c["chunk_id"] for c in chunks]}, f)
-    return bm25, [c["chunk_id"] for c in chunks]
-
-def load_bm25():
-    import pickle
-    with open(Path(BM25_DIR)/"bm25.pkl", "rb") as f:
-        obj = pickle.load(f)
-    return obj["bm25"], obj["ids"]
+        bm25.save(bm25_dir, ids)
+    return bm25, ids
+
+def load_bm25(bm25_dir=None):
+    """Load the BM25 index in bm25_dir (default: the current snapshot's)."""
+    bm25_dir = Path(bm25_dir) if bm25_dir is not None else current_snapshot().bm25_dir
+    assert (bm25_dir/"bm25.json").exists(), "BM25 index not found. Build index first."
+    return SparseBM25.load(bm25_dir)
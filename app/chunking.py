@@ -1,30 +1,157 @@
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from .config import CHUNK_TOKENS, CHUNK_OVERLAP
-from .utils import make_id, write_json
+from collections import deque
+from functools import lru_cache
+from .config import CHUNK_TOKENS, CHUNK_OVERLAP, CHUNK_MODE, CHUNK_OVERLAP_TOKENS
+from .utils import stable_id, text_hash, write_json
 from pathlib import Path
 import math, os
 
-def chunk_pages(pages):
+SEPARATORS = ["\n\n", "\n", ".", " ", ""]
+
+class RecursiveSplitter:
     """
-    pages: list of {"page_index", "text", "page_id"}
-    returns list of chunks with metadata:
+    Recursive character splitter with the same separator hierarchy, merge and overlap
+    rules as LangChain's RecursiveCharacterTextSplitter (keep_separator=True,
+    strip_whitespace=True), but working on (start, end) spans of the original text,
+    so every chunk's offsets are known exactly without searching for it afterwards.
+    """
+
+    def __init__(self, chunk_size=CHUNK_TOKENS, chunk_overlap=CHUNK_OVERLAP, separators=SEPARATORS, length_function=None):
+        if chunk_overlap > chunk_size:
+            raise ValueError(f"Got a larger chunk overlap ({chunk_overlap}) than chunk size ({chunk_size}), should be smaller.")
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.separators = separators
+        # None measures spans in characters without slicing the text
+        self.length_function = length_function
+
+    def _len(self, text, start, end):
+        if self.length_function is None:
+            return end - start
+        return self.length_function(text[start:end])
+
+    @staticmethod
+    def _split_on(text, start, end, separator):
+        # the separator stays at the start of the piece that follows it
+        if separator == "":
+            return [(i, i + 1) for i in range(start, end)]
+        cuts = [start]
+        pos = text.find(separator, start, end)
+        while pos != -1:
+            cuts.append(pos)
+            pos = text.find(separator, pos + len(separator), end)
+        cuts.append(end)
+        return [(a, b) for a, b in zip(cuts, cuts[1:]) if b > a]
+
+    @staticmethod
+    def _strip(text, start, end):
+        """Span of text[start:end].strip(), or None when it is blank."""
+        while start < end and text[start].isspace():
+            start += 1
+        while end > start and text[end - 1].isspace():
+            end -= 1
+        return (start, end) if start < end else None
+
+    def _merge(self, text, spans):
+        # pieces are contiguous, so a merged chunk is the span from its first to its last piece
+        chunks = []
+        window = deque()
+        total = 0
+        chunk_size, length = self.chunk_size, self._len
+        for s, e in spans:
+            n = length(text, s, e)
+            if total + n > chunk_size and window:
+                chunk = self._strip(text, window[0][0], window[-1][1])
+                if chunk is not None:
+                    chunks.append(chunk)
+                # drop pieces from the front until what is left fits in the overlap
+                while total > self.chunk_overlap or (total + n > self.chunk_size and total > 0):
+                    total -= window.popleft()[2]
+            window.append((s, e, n))
+            total += n
+        if window:
+            chunk = self._strip(text, window[0][0], window[-1][1])
+            if chunk is not None:
+                chunks.append(chunk)
+        return chunks
+
+    def _split(self, text, start, end, separators):
+        separator = separators[-1]
+        new_separators = []
+        for i, sep in enumerate(separators):
+            if sep == "":
+                separator = sep
+                break
+            if text.find(sep, start, end) != -1:
+                separator = sep
+                new_separators = separators[i + 1:]
+                break
+
+        chunks = []
+        good = []
+        for s, e in self._split_on(text, start, end, separator):
+            if self._len(text, s, e) < self.chunk_size:
+                good.append((s, e))
+                continue
+            if good:
+                chunks.extend(self._merge(text, good))
+                good = []
+            if not new_separators:
+                chunks.append((s, e))
+            else:
+                chunks.extend(self._split(text, s, e, new_separators))
+        if good:
+            chunks.extend(self._merge(text, good))
+        return chunks
+
+    def split_spans(self, text):
+        """Chunk boundaries as (start_char, end_char) pairs into text."""
+        return self._split(text, 0, len(text), self.separators)
+
+    def split_text(self, text):
+        return [text[s:e] for s, e in self.split_spans(text)]
+
+def token_splitter(model=None, max_tokens=CHUNK_TOKENS, overlap_tokens=CHUNK_OVERLAP_TOKENS):
+    """
+    Splitter that measures length with the embedding model's tokenizer and caps chunks at
+    what the model actually embeds (max_seq_length minus special tokens), so no chunk text
+    is silently truncated by the encoder.
+    """
+    if model is None:
+        from .models import get_embedding_model
+        model = get_embedding_model()
+    tokenizer = model.tokenizer
+    special = tokenizer.num_special_tokens_to_add() if hasattr(tokenizer, "num_special_tokens_to_add") else 2
+    chunk_size = min(max_tokens, model.max_seq_length - special)
+
+    # the recursive merge measures the same pieces repeatedly
+    @lru_cache(maxsize=65536)
+    def n_tokens(text):
+        return len(tokenizer.tokenize(text))
+
+    return RecursiveSplitter(chunk_size=chunk_size, chunk_overlap=min(overlap_tokens, chunk_size), length_function=n_tokens)
+
+def make_splitter(mode=CHUNK_MODE):
+    """CHUNK_MODE "chars" (default): CHUNK_TOKENS characters; "tokens": embedding-model tokens."""
+    if mode == "tokens":
+        return token_splitter()
+    if mode != "chars":
+        raise ValueError(f"Unknown CHUNK_MODE: {mode}")
+    return RecursiveSplitter(chunk_size=CHUNK_TOKENS, chunk_overlap=CHUNK_OVERLAP)
+
+def iter_chunks(pages, splitter=None):
+    """
+    pages: iterable of {"page_index", "text", "page_id"} (may be a generator from the parser)
+    yields chunks with metadata as each page is split:
     {"chunk_id","page_index","text","start_char","end_char","order"}
+    chunk_id is derived from the page id (document hash + page index), offsets and text hash.
     """
-    splitter = RecursiveCharacterTextSplitter(
-        chunk_size=CHUNK_TOKENS,
-        chunk_overlap=CHUNK_OVERLAP,
-        separators=["\n\n", "\n", ".", " ", ""]
-    )
-    all_chunks = []
+    splitter = splitter or make_splitter()
     order = 0
     for p in pages:
-        pieces = splitter.split_text(p["text"])
-        char_cursor = 0
-        for piece in pieces:
-            start = p["text"].find(piece, char_cursor)
-            end = start + len(piece) if start >= 0 else char_cursor
+        for start, end in splitter.split_spans(p["text"]):
+            piece = p["text"][start:end]
             chunk = {
-                "chunk_id": make_id("c"),
+                "chunk_id": stable_id("c", p["page_id"], start, end, text_hash(piece)),
                 "page_id": p["page_id"],
                 "page_index": p["page_index"],
                 "order": order,
@@ -32,7 +159,12 @@ def chunk_pages(pages):
                 "start_char": start,
                 "end_char": end
             }
-            all_chunks.append(chunk)
+            yield chunk
             order += 1
-            char_cursor = end
-    return all_chunks
+
+def chunk_pages(pages, splitter=None):
+    """
+    pages: list of {"page_index", "text", "page_id"}
+    returns list of chunks (see iter_chunks)
+    """
+    return list(iter_chunks(pages, splitter=splitter))
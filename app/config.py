@@ -10,6 +10,10 @@ FAISS_DIR = DATA_DIR / "faiss_index"
 META_DIR = DATA_DIR / "metadata"
 BM25_DIR = DATA_DIR / "bm25_index"
 LOG_DIR = ROOT / "logs"
+EMBEDDING_CACHE_DIR = DATA_DIR / "embedding_cache"
+# versioned index snapshots (FAISS, BM25, chunk table) and the CURRENT pointer
+SNAPSHOT_DIR = DATA_DIR / "snapshots"
+SNAPSHOT_KEEP = int(os.getenv("SNAPSHOT_KEEP", 3))
 
 # Grok API
 GROK_API_URL = os.getenv("GROK_API_URL", "https://api.groq.com/openai/v1/chat/completions")
@@ -18,17 +22,71 @@ GROK_API_KEY = os.getenv("GROK_API_KEY", "")
 # Embeddings / models
 EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "sentence-transformers/all-mpnet-base-v2")
 CROSS_ENCODER_MODEL = os.getenv("CROSS_ENCODER_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+WARMUP_MODELS = os.getenv("WARMUP_MODELS", "1") == "1"
+EMBEDDING_CACHE = os.getenv("EMBEDDING_CACHE", "1") == "1"
+
+# PDF parsing (PDF_PARSE_WORKERS > 1 enables the process pool for large documents)
+PDF_PARSE_WORKERS = int(os.getenv("PDF_PARSE_WORKERS", 0))
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", 64))
+# uploads up to this size are parsed straight from memory; larger ones are spooled to a temp file
+PDF_SPOOL_THRESHOLD = int(os.getenv("PDF_SPOOL_THRESHOLD", 32 * 1024 * 1024))
+
+# Boilerplate: lines found on at least this fraction of pages are stripped before chunking
+BOILERPLATE_STRIP = os.getenv("BOILERPLATE_STRIP", "1") == "1"
+BOILERPLATE_MIN_FRACTION = float(os.getenv("BOILERPLATE_MIN_FRACTION", 0.6))
+BOILERPLATE_MIN_PAGES = int(os.getenv("BOILERPLATE_MIN_PAGES", 3))
 
 # Chunking
+# CHUNK_MODE "chars": CHUNK_TOKENS/CHUNK_OVERLAP are character counts (default).
+# CHUNK_MODE "tokens": lengths are embedding-model tokens, capped at the model's max sequence length.
+CHUNK_MODE = os.getenv("CHUNK_MODE", "chars")
 CHUNK_TOKENS = int(os.getenv("CHUNK_TOKENS", 1000))
 CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", 200))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", 48))
+
+# Near-duplicate chunks (MinHash/LSH): copies of a chunk within a document are embedded once
+DEDUP_CHUNKS = os.getenv("DEDUP_CHUNKS", "1") == "1"
+DEDUP_THRESHOLD = float(os.getenv("DEDUP_THRESHOLD", 0.9))
+MINHASH_NUM_PERM = int(os.getenv("MINHASH_NUM_PERM", 64))
+MINHASH_BANDS = int(os.getenv("MINHASH_BANDS", 16))
+
+# Ingestion: chunks are embedded and indexed in batches while parsing continues
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", 64))
 
 # Retrieval
+# FAISS_INDEX_TYPE "auto" picks flat / hnsw / hnsw_sq8 / ivfpq from the vector count and memory budget
+FAISS_INDEX_TYPE = os.getenv("FAISS_INDEX_TYPE", "auto")
+FAISS_FLAT_MAX_VECTORS = int(os.getenv("FAISS_FLAT_MAX_VECTORS", 20000))
+FAISS_MEMORY_BUDGET_MB = int(os.getenv("FAISS_MEMORY_BUDGET_MB", 2048))
+FAISS_TRAIN_SIZE = int(os.getenv("FAISS_TRAIN_SIZE", 32768))
+IVF_NPROBE = int(os.getenv("IVF_NPROBE", 16))
+# open the FAISS index memory-mapped (read-only) so worker processes share its pages
+FAISS_MMAP = os.getenv("FAISS_MMAP", "1") == "1"
 HNSW_M = int(os.getenv("HNSW_M", 32))
 HNSW_EF_CONSTRUCTION = int(os.getenv("HNSW_EF_CONSTRUCTION", 200))
+# default search effort (candidate list size) per query; callers can override it per query
+HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH", 64))
 TOP_K_DENSE = int(os.getenv("TOP_K_DENSE", 16))
 TOP_K_BM25 = int(os.getenv("TOP_K_BM25", 20))
 RE_RANK_K = int(os.getenv("RE_RANK_K", 12))
+# dense and BM25 candidates are fused by "rrf" (reciprocal rank) or "weighted" (min-max normalized scores);
+# BM25 gets 1 - FUSION_DENSE_WEIGHT
+FUSION_METHOD = os.getenv("FUSION_METHOD", "rrf")
+RRF_K = int(os.getenv("RRF_K", 60))
+FUSION_DENSE_WEIGHT = float(os.getenv("FUSION_DENSE_WEIGHT", 0.5))
+# fused candidates per query scored by the cross-encoder (its cost is linear in this); RE_RANK_K of them are returned
+RERANK_BUDGET = int(os.getenv("RERANK_BUDGET", RE_RANK_K))
+# dense and BM25 legs run concurrently; a leg slower than its timeout is dropped (seconds per query
+# of the batch, counted from when the leg starts running; waiting for a pool worker is bounded by
+# the same budget; 0 = none)
+RETRIEVAL_WORKERS = int(os.getenv("RETRIEVAL_WORKERS", 4))
+DENSE_LEG_TIMEOUT = float(os.getenv("DENSE_LEG_TIMEOUT", 2.0))
+BM25_LEG_TIMEOUT = float(os.getenv("BM25_LEG_TIMEOUT", 2.0))
+# per-process query caches: ranked results (keyed by snapshot) and query embeddings; size 0 disables
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", 1024))
+QUERY_CACHE_TTL = float(os.getenv("QUERY_CACHE_TTL", 600))
+QUERY_EMBEDDING_CACHE_SIZE = int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", 4096))
+QUERY_EMBEDDING_CACHE_TTL = float(os.getenv("QUERY_EMBEDDING_CACHE_TTL", 3600))
 
 # Summarization settings
 SUMMARIZE_BATCH_TOKENS = int(os.getenv("SUMMARIZE_BATCH_TOKENS", 3500))
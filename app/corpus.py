@@ -0,0 +1,197 @@
+from .indexer import build_faiss_index, rebuild_faiss_index, add_to_faiss_index, index_type_outdated, IndexOutOfSync
+from .bm25_search import build_bm25, add_to_bm25, BM25_FORMAT_VERSION
+from .pdf_parser import iter_text_pages, strip_boilerplate
+from .chunking import iter_chunks
+from .dedup import dedup_chunks
+from .snapshots import current_snapshot, new_snapshot, publish, discard, writer_lock
+from .config import META_DIR, EMBED_BATCH_SIZE, BOILERPLATE_STRIP, DEDUP_CHUNKS
+from .utils import make_id, now_iso, write_json, read_json, prefetch
+from pathlib import Path
+import itertools, threading
+
+# content-hash ingestion cache counters (per process)
+_cache_stats = {"hits": 0, "misses": 0}
+_cache_lock = threading.Lock()
+
+def cache_stats():
+    with _cache_lock:
+        return dict(_cache_stats)
+
+def _pages_path(meta_dir, doc_id):
+    return Path(meta_dir) / "pages" / f"{doc_id}.json"
+
+def _read_corpus(table_dir):
+    chunks_path = Path(table_dir) / "chunks.json"
+    docs_path = Path(table_dir) / "documents.json"
+    chunks = read_json(chunks_path) if chunks_path.exists() else []
+    documents = read_json(docs_path) if docs_path.exists() else []
+    return chunks, documents
+
+def load_corpus(meta_dir=META_DIR):
+    """
+    returns (chunks, documents) of the current snapshot.
+    chunks are stored in corpus row order; a chunk's row is also its FAISS label and BM25 column.
+    """
+    return _read_corpus(current_snapshot(meta_dir).meta_dir)
+
+def _find_document(documents, content_hash):
+    return next((d for d in documents if d.get("content_hash") == content_hash), None)
+
+def _document_chunks(corpus, record):
+    return corpus[record["first_row"]:record["first_row"] + record["num_chunks"]]
+
+def lookup_document(content_hash, meta_dir=META_DIR):
+    """
+    Look up a previously ingested PDF by the hash of its bytes.
+    returns (record, pages, chunks) on a hit, None on a miss; hits and misses are counted.
+    Only the small document table is read for the lookup; the chunk table only on a hit.
+    """
+    table_dir = current_snapshot(meta_dir).meta_dir
+    docs_path = table_dir / "documents.json"
+    record = _find_document(read_json(docs_path), content_hash) if docs_path.exists() else None
+    pages_path = _pages_path(meta_dir, record["doc_id"]) if record else None
+    hit = record is not None and pages_path.exists()
+    with _cache_lock:
+        _cache_stats["hits" if hit else "misses"] += 1
+    if not hit:
+        return None
+    corpus, _ = _read_corpus(table_dir)
+    return record, read_json(pages_path), _document_chunks(corpus, record)
+
+def _bm25_rows(bm25_dir):
+    bm25_meta = Path(bm25_dir) / "bm25.json"
+    if not bm25_meta.exists():
+        return None
+    meta = read_json(bm25_meta)
+    return meta["num_docs"] if meta.get("format_version") == BM25_FORMAT_VERSION else None
+
+def _tag(chunks, doc_id, collected):
+    for c in chunks:
+        c["doc_id"] = doc_id
+        collected.append(c)
+        yield c
+
+def _check_index_type(all_chunks, faiss_dir):
+    # a streamed index is typed for what it had seen; once the corpus outgrows that type it is
+    # rebuilt with the full count known, from the vectors it holds (the model is not run)
+    if index_type_outdated(faiss_dir):
+        rebuild_faiss_index(all_chunks, faiss_dir=faiss_dir)
+
+def _append_to_indices(corpus, chunks, doc_id, base, snapshot):
+    """
+    Stream chunks into the FAISS index (batch by batch) and then into BM25, reading the
+    indices of the base snapshot and writing the results into the new one.
+    returns the list of appended chunks.
+    """
+    start = len(corpus)
+    collected = []
+    stream = _tag(chunks, doc_id, collected)
+    if start == 0 or _bm25_rows(base.bm25_dir) == start:
+        try:
+            add_to_faiss_index(stream, start_label=start, persist=True, faiss_dir=snapshot.faiss_dir, base_dir=base.faiss_dir)
+        except IndexOutOfSync:
+            # raised before the stream is read, so the rebuild below still sees every chunk;
+            # any later failure propagates and the new snapshot is discarded
+            pass
+        else:
+            if collected:
+                if start == 0:
+                    build_bm25(collected, persist=True, bm25_dir=snapshot.bm25_dir)
+                else:
+                    add_to_bm25(collected, persist=True, bm25_dir=snapshot.bm25_dir, base_dir=base.bm25_dir)
+                _check_index_type(corpus + collected, snapshot.faiss_dir)
+            return collected
+    # missing or out-of-sync indices: rebuild them once over the whole corpus
+    build_faiss_index(itertools.chain(corpus, stream), persist=True, faiss_dir=snapshot.faiss_dir)
+    build_bm25(corpus + collected, persist=True, bm25_dir=snapshot.bm25_dir)
+    _check_index_type(corpus + collected, snapshot.faiss_dir)
+    return collected
+
+def ingest_document(chunks, filename=None, num_pages=None, meta_dir=META_DIR, content_hash=None, pages=None, extra=None):
+    """
+    Append the chunks of one document to the corpus and the FAISS/BM25 indices.
+    chunks may be a generator: it is consumed batch by batch while embedding.
+    Only the new chunks are encoded; earlier documents are not re-embedded.
+    With content_hash, the pages are kept for the ingestion cache and a document
+    already ingested with the same hash is returned as is.
+    extra: additional fields stored in the document record (e.g. boilerplate stats).
+    returns (record, chunks): the document record (with 'doc_id', 'first_row', 'num_chunks')
+    and the document's chunks as stored in the corpus; record is None when there were no chunks.
+    """
+    # one writer at a time (threads and processes): the new snapshot extends the current one
+    with writer_lock():
+        base = current_snapshot(meta_dir)
+        corpus, documents = _read_corpus(base.meta_dir)
+        if content_hash is not None:
+            existing = _find_document(documents, content_hash)
+            if existing is not None:
+                return existing, _document_chunks(corpus, existing)
+        doc_id = f"d_{content_hash[:12]}" if content_hash else make_id("d")
+        start = len(corpus)
+
+        # readers keep using the current snapshot until the new one is complete and published
+        snapshot = new_snapshot()
+        try:
+            chunks = _append_to_indices(corpus, chunks, doc_id, base, snapshot)
+            if not chunks:
+                discard(snapshot)
+                return None, []
+
+            record = {
+                "doc_id": doc_id,
+                "filename": filename,
+                # pages may have been filled while the chunk stream was consumed
+                "num_pages": len(pages) if pages is not None else num_pages,
+                "num_chunks": len(chunks),
+                "first_row": start,
+                "content_hash": content_hash,
+                "ingested_at": now_iso(),
+                **(extra or {}),
+            }
+            if pages is not None:
+                # pages are per document and never rewritten, so they live outside the snapshots
+                write_json(_pages_path(meta_dir, doc_id), pages)
+            documents.append(record)
+            write_json(snapshot.meta_dir / "chunks.json", corpus + chunks)
+            write_json(snapshot.meta_dir / "documents.json", documents)
+        except BaseException:
+            discard(snapshot)
+            raise
+        publish(snapshot)
+        return record, chunks
+
+def _collect(items, out):
+    for item in items:
+        out.append(item)
+        yield item
+
+def ingest_pdf(source, filename=None, doc_hash=None, meta_dir=META_DIR):
+    """
+    Streaming ingestion of one PDF (source: file path or in-memory PDF bytes): pages flow into the chunker and chunks into fixed-size
+    embedding batches, with parsing and chunking running ahead in a background thread
+    (bounded buffer) while batches are encoded and added to the index.
+    With BOILERPLATE_STRIP, repeated header/footer lines are removed first; that needs every
+    page, so pages are extracted up front and only chunking and embedding are streamed.
+    With DEDUP_CHUNKS, near-duplicate chunks (repeated lab sheets, consent forms) are indexed
+    once; the copies are listed under 'duplicates' on the canonical chunk.
+    returns (record, pages, chunks); record is None when the PDF has no extractable text.
+    """
+    extra = {}
+    if BOILERPLATE_STRIP:
+        pages, extra["boilerplate"] = strip_boilerplate(list(iter_text_pages(source, doc_hash=doc_hash)))
+        page_stream = iter(pages)
+    else:
+        pages = []
+        page_stream = _collect(iter_text_pages(source, doc_hash=doc_hash), pages)
+    chunk_stream = iter_chunks(page_stream)
+    if DEDUP_CHUNKS:
+        # filled in while the stream is consumed, before the record is written
+        extra["dedup"] = {}
+        chunk_stream = dedup_chunks(chunk_stream, stats=extra["dedup"])
+    chunk_stream = prefetch(chunk_stream, maxsize=2 * EMBED_BATCH_SIZE)
+    record, chunks = ingest_document(chunk_stream, filename=filename, meta_dir=meta_dir,
+                                     content_hash=doc_hash, pages=pages, extra=extra)
+    if record is not None and not pages:
+        # already ingested under the same hash: the stream was never consumed
+        pages = read_json(_pages_path(meta_dir, record["doc_id"]))
+    return record, pages, chunks
@@ -0,0 +1,87 @@
+import numpy as np
+import re, zlib
+from .config import DEDUP_THRESHOLD, MINHASH_NUM_PERM, MINHASH_BANDS
+
+_PRIME = (1 << 31) - 1  # keeps a * h + b within uint64
+
+def shingles(text, k=3):
+    """Set of word k-grams of the normalized text (the whole text when shorter than k words)."""
+    words = re.sub(r"\s+", " ", text.lower()).strip().split(" ")
+    if len(words) <= k:
+        return {" ".join(words)}
+    return {" ".join(words[i:i + k]) for i in range(len(words) - k + 1)}
+
+class MinHashLSH:
+    """
+    MinHash signatures with banded LSH buckets for near-duplicate lookup.
+    Candidates sharing a band are confirmed with the signature estimate of their
+    Jaccard similarity, so only pairs at or above threshold are returned.
+    """
+
+    def __init__(self, threshold=DEDUP_THRESHOLD, num_perm=MINHASH_NUM_PERM, bands=MINHASH_BANDS, seed=1):
+        assert num_perm % bands == 0, "MINHASH_NUM_PERM must be a multiple of MINHASH_BANDS"
+        rng = np.random.RandomState(seed)
+        self.a = rng.randint(1, _PRIME, size=num_perm).astype(np.uint64)
+        self.b = rng.randint(0, _PRIME, size=num_perm).astype(np.uint64)
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = num_perm // bands
+        self._buckets = [{} for _ in range(bands)]
+        self._signatures = {}
+
+    def signature(self, text):
+        h = np.fromiter((zlib.crc32(s.encode("utf-8")) % _PRIME for s in shingles(text)), dtype=np.uint64)
+        return ((self.a[:, None] * h[None, :] + self.b[:, None]) % _PRIME).min(axis=1)
+
+    def _band_keys(self, sig):
+        return [sig[i * self.rows:(i + 1) * self.rows].tobytes() for i in range(self.bands)]
+
+    def query(self, sig):
+        """(key, estimated similarity) of the closest indexed signature at or above threshold, or None."""
+        candidates = set()
+        for bucket, band in zip(self._buckets, self._band_keys(sig)):
+            candidates.update(bucket.get(band, ()))
+        best = None
+        for key in candidates:
+            sim = float(np.mean(self._signatures[key] == sig))
+            if sim >= self.threshold and (best is None or sim > best[1]):
+                best = (key, sim)
+        return best
+
+    def add(self, key, sig):
+        self._signatures[key] = sig
+        for bucket, band in zip(self._buckets, self._band_keys(sig)):
+            bucket.setdefault(band, []).append(key)
+
+def dedup_chunks(chunks, stats=None, lsh=None):
+    """
+    Stream filter yielding only canonical chunks. A chunk that is a near duplicate of an
+    earlier one is not yielded (so it is neither embedded nor summarized); it is recorded
+    on its canonical chunk under 'duplicates' with its own id, page and offsets.
+    stats, if given, is updated with 'duplicate_chunks' and 'duplicate_groups'.
+    """
+    lsh = lsh or MinHashLSH()
+    canonical = {}
+    stats = stats if stats is not None else {}
+    stats.setdefault("duplicate_chunks", 0)
+    stats.setdefault("duplicate_groups", 0)
+    for c in chunks:
+        sig = lsh.signature(c["text"])
+        match = lsh.query(sig)
+        if match is None:
+            lsh.add(c["chunk_id"], sig)
+            canonical[c["chunk_id"]] = c
+            yield c
+            continue
+        # the canonical chunk was already yielded; the same dict ends up in the corpus
+        group = canonical[match[0]].setdefault("duplicates", [])
+        if not group:
+            stats["duplicate_groups"] += 1
+        group.append({
+            "chunk_id": c["chunk_id"],
+            "page_index": c["page_index"],
+            "start_char": c["start_char"],
+            "end_char": c["end_char"],
+            "similarity": round(match[1], 3),
+        })
+        stats["duplicate_chunks"] += 1
@@ -0,0 +1,118 @@
+import numpy as np
+import hashlib, os, re, threading, unicodedata
+from pathlib import Path
+from .config import EMBEDDING_CACHE_DIR
+from .utils import write_json, read_json, file_lock
+
+KEY_BYTES = 32
+
+def text_key(text):
+    """sha256 of the text after unicode and whitespace normalization (the encoder ignores both)."""
+    norm = re.sub(r"\s+", " ", unicodedata.normalize("NFC", text)).strip()
+    return hashlib.sha256(norm.encode("utf-8")).digest()
+
+class EmbeddingCache:
+    """
+    Append-only embedding store for one model.
+    vectors.f32 holds float32 rows (memory-mapped for reads), keys.bin the 32-byte
+    text key of each row; a row only counts once both files contain it.
+    """
+
+    def __init__(self, model_name, cache_dir=EMBEDDING_CACHE_DIR):
+        slug = re.sub(r"[^A-Za-z0-9_.-]+", "__", model_name)
+        self.dir = Path(cache_dir) / slug
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self.model_name = model_name
+        self._lock = threading.Lock()
+        self._rows = {}
+        self._keys_read = 0
+        self._vectors = None
+
+    @property
+    def _meta_path(self):
+        return self.dir / "meta.json"
+
+    def _dim(self):
+        return read_json(self._meta_path)["dim"] if self._meta_path.exists() else None
+
+    def _refresh(self):
+        """Pick up rows appended since the last call (possibly by another process)."""
+        dim = self._dim()
+        keys_path, vec_path = self.dir / "keys.bin", self.dir / "vectors.f32"
+        if dim is None or not keys_path.exists() or not vec_path.exists():
+            return
+        n = min(keys_path.stat().st_size // KEY_BYTES, vec_path.stat().st_size // (4 * dim))
+        if n > self._keys_read:
+            with open(keys_path, "rb") as f:
+                f.seek(self._keys_read * KEY_BYTES)
+                blob = f.read((n - self._keys_read) * KEY_BYTES)
+            for i in range(n - self._keys_read):
+                self._rows.setdefault(blob[i * KEY_BYTES:(i + 1) * KEY_BYTES], self._keys_read + i)
+            self._keys_read = n
+        if n and (self._vectors is None or self._vectors.shape[0] != n):
+            self._vectors = np.memmap(vec_path, dtype=np.float32, mode="r", shape=(n, dim))
+
+    def lookup(self, texts):
+        """returns (keys, vectors or None, indices of texts that are not cached)."""
+        keys = [text_key(t) for t in texts]
+        with self._lock:
+            self._refresh()
+            rows = [self._rows.get(k) for k in keys]
+            missing = [i for i, r in enumerate(rows) if r is None]
+            if len(missing) == len(texts):
+                return keys, None, missing
+            out = np.zeros((len(texts), self._vectors.shape[1]), dtype=np.float32)
+            hit = [i for i, r in enumerate(rows) if r is not None]
+            out[hit] = self._vectors[[rows[i] for i in hit]]
+            return keys, out, missing
+
+    def rows_for(self, texts):
+        """Cache rows of texts, read only (nothing is encoded or written); KeyError when one is not cached."""
+        keys = [text_key(t) for t in texts]
+        with self._lock:
+            self._refresh()
+            rows = [self._rows.get(k) for k in keys]
+        missing = sum(r is None for r in rows)
+        if missing:
+            raise KeyError(f"{missing} of {len(texts)} texts are not in the embedding cache of {self.model_name}")
+        return np.array(rows, dtype=np.int64)
+
+    def vectors(self, rows):
+        """Vectors of cache rows returned by rows_for."""
+        with self._lock:
+            return np.asarray(self._vectors[rows])
+
+    def add(self, keys, vectors):
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        with self._lock:
+            if self._dim() is None:
+                write_json(self._meta_path, {"model": self.model_name, "dim": int(vectors.shape[1])})
+            assert self._dim() == vectors.shape[1], "Embedding dimension changed for this model cache."
+            with file_lock(self.dir / "cache.lock"):
+                self._refresh()
+                # drop a partially written tail left by an interrupted append
+                for name, width in (("vectors.f32", 4 * vectors.shape[1]), ("keys.bin", KEY_BYTES)):
+                    path = self.dir / name
+                    if path.exists() and path.stat().st_size != self._keys_read * width:
+                        os.truncate(path, self._keys_read * width)
+                fresh, seen = [], set()
+                for i, k in enumerate(keys):
+                    if k not in self._rows and k not in seen:
+                        fresh.append(i)
+                        seen.add(k)
+                if fresh:
+                    # vectors first: a key without its row is ignored, never misread
+                    with open(self.dir / "vectors.f32", "ab") as f:
+                        f.write(vectors[fresh].tobytes())
+                    with open(self.dir / "keys.bin", "ab") as f:
+                        f.write(b"".join(keys[i] for i in fresh))
+                self._refresh()
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+def get_embedding_cache(model_name):
+    with _caches_lock:
+        if model_name not in _caches:
+            _caches[model_name] = EmbeddingCache(model_name)
+        return _caches[model_name]
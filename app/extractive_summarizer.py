@@ -6,17 +6,17 @@ Implements extractive summarization by selecting the most important sentences fr
 import numpy as np
 from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.metrics.pairwise import cosine_similarity
-from sentence_transformers import SentenceTransformer
 import re
 from typing import List, Dict, Tuple
 from pathlib import Path
 from .utils import log_event, write_json
+from .models import get_embedding_model
 import time
 
 class ExtractiveSummarizer:
     def __init__(self):
         # Load sentence transformer for semantic similarity
-        self.sentence_model = SentenceTransformer('sentence-transformers/all-mpnet-base-v2')
+        self.sentence_model = get_embedding_model()
         
         # Medical keywords that indicate importance
         self.medical_keywords = {
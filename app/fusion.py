@@ -0,0 +1,42 @@
+import numpy as np
+from .config import FUSION_METHOD, RRF_K, FUSION_DENSE_WEIGHT
+
+def rrf_scores(rankings, weights, k=RRF_K):
+    """Reciprocal Rank Fusion: sum of weight / (k + rank) over the rankings an id appears in (rank from 1)."""
+    fused = {}
+    for ids, weight in zip(rankings, weights):
+        for rank, cid in enumerate(ids, 1):
+            fused[cid] = fused.get(cid, 0.0) + weight / (k + rank)
+    return fused
+
+def weighted_scores(rankings, scores, weights):
+    """
+    Weighted sum of min-max normalized scores (higher is better); an id missing from a ranking
+    gets 0 there, and so does every id of a ranking whose scores are all equal (no signal).
+    """
+    fused = {}
+    for ids, raw, weight in zip(rankings, scores, weights):
+        if not len(ids):
+            continue
+        raw = np.asarray(raw, dtype=np.float64)
+        span = raw.max() - raw.min()
+        norm = (raw - raw.min()) / span if span > 0 else np.zeros_like(raw)
+        for cid, value in zip(ids, (weight * norm).tolist()):
+            fused[cid] = fused.get(cid, 0.0) + value
+    return fused
+
+def fuse(dense, sparse, method=FUSION_METHOD, dense_weight=FUSION_DENSE_WEIGHT):
+    """
+    dense, sparse: (ids, scores) of one query, best first. Returns (ids, fused scores) best
+    first; ties keep the dense-then-sparse order of first appearance.
+    """
+    assert method in ("rrf", "weighted"), f"Unknown FUSION_METHOD: {method}"
+    rankings, weights = (dense[0], sparse[0]), (dense_weight, 1.0 - dense_weight)
+    if method == "rrf":
+        fused = rrf_scores(rankings, weights)
+    else:
+        fused = weighted_scores(rankings, (dense[1], sparse[1]), weights)
+    ids = list(fused)
+    values = np.fromiter(fused.values(), dtype=np.float64, count=len(ids))
+    order = np.argsort(-values, kind="stable")
+    return [ids[i] for i in order], values[order]
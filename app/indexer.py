@@ -1,40 +1,291 @@
 import faiss, numpy as np, os
-from sentence_transformers import SentenceTransformer
-from .config import EMBEDDING_MODEL, FAISS_DIR, HNSW_M, HNSW_EF_CONSTRUCTION
-from .utils import write_json, read_json
+from .models import get_embedding_model
+from .embedding_cache import get_embedding_cache
+from .config import (FAISS_DIR, HNSW_M, HNSW_EF_CONSTRUCTION, EMBEDDING_MODEL, EMBEDDING_CACHE, EMBED_BATCH_SIZE,
+                     FAISS_INDEX_TYPE, FAISS_FLAT_MAX_VECTORS, FAISS_MEMORY_BUDGET_MB, FAISS_TRAIN_SIZE, IVF_NPROBE, HNSW_EF_SEARCH, FAISS_MMAP)
+from .utils import write_json, read_json, save_npy
+from .snapshots import current_snapshot
 from pathlib import Path
 
 Path(FAISS_DIR).mkdir(parents=True, exist_ok=True)
 
-def build_faiss_index(chunks, persist=True):
+def _encode(model, texts, show_progress_bar=True):
+    """Normalized embeddings for texts; only texts missing from the embedding cache are encoded."""
+    if not EMBEDDING_CACHE:
+        return model.encode(texts, show_progress_bar=show_progress_bar, convert_to_numpy=True,normalize_embeddings=True)
+    cache = get_embedding_cache(EMBEDDING_MODEL)
+    keys, vectors, missing = cache.lookup(texts)
+    if missing:
+        encoded = model.encode([texts[i] for i in missing], show_progress_bar=show_progress_bar, convert_to_numpy=True,normalize_embeddings=True)
+        cache.add([keys[i] for i in missing], encoded)
+        if vectors is None:
+            return encoded.astype(np.float32)
+        vectors[missing] = encoded
+    return vectors
+
+def cached_rows(texts):
     """
-    chunks: list of dicts with 'chunk_id' and 'text'
-    returns: index, model, id_map
+    Embedding cache rows of texts whose vectors must not be recomputed (IVF-PQ cannot give them
+    back). Raises instead of encoding when the cache is disabled or lacks any of them.
     """
-    texts = [c["text"] for c in chunks]
-    ids = [c["chunk_id"] for c in chunks]
-    model = SentenceTransformer(EMBEDDING_MODEL)
-    vectors = model.encode(texts, show_progress_bar=True, convert_to_numpy=True,normalize_embeddings=True)
+    if not EMBEDDING_CACHE:
+        raise RuntimeError("IVF-PQ indices need EMBEDDING_CACHE=1: their exact vectors are only kept in the embedding cache")
+    return get_embedding_cache(EMBEDDING_MODEL).rows_for(texts)
 
-    dim = vectors.shape[1]
-    # HNSW index
-    index = faiss.IndexHNSWFlat(dim, HNSW_M)
-    index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
-    index = faiss.IndexIDMap(index)
-    index.add_with_ids(vectors, np.array(range(len(ids))))
-    id_map = {i: ids[i] for i in range(len(ids))}
+def cached_vectors(rows):
+    return get_embedding_cache(EMBEDDING_MODEL).vectors(rows)
 
-    if persist:
-        faiss.write_index(index, str(Path(FAISS_DIR) / "medical_hnsw.index"))
-        write_json(Path(FAISS_DIR) / "id_map.json", id_map)
+def stored_vectors(index, spec, start, stop, texts):
+    """
+    Vectors of labels [start, stop) without running the model: read back from flat and HNSW
+    storage (labels are positions in the index), for IVF-PQ taken from the embedding cache.
+    texts are the chunk texts of those labels (used for IVF-PQ only).
+    """
+    if spec["index_type"] == "ivfpq":
+        return cached_vectors(cached_rows(texts))
+    return faiss.downcast_index(index.index).reconstruct_n(start, stop - start)
 
-    return index, model, id_map
+INDEX_TYPES = ("flat", "hnsw", "hnsw_sq8", "ivfpq")  # in order of increasing corpus size
+# legacy indices were always HNSW over raw vectors and have no index_meta.json
+_LEGACY_SPEC = {"index_type": "hnsw", "factory": f"IDMap,HNSW{HNSW_M},Flat", "params": {"M": HNSW_M}}
+
+def _pq_m(dim):
+    # largest number of PQ sub-quantizers (at most 64) that divides dim
+    return max(m for m in range(1, min(64, dim) + 1) if dim % m == 0)
+
+def _bytes_per_vector(kind, dim):
+    graph = int(2 * HNSW_M * 4 * 1.1)  # level-0 links (2M int32) plus the upper levels
+    # every type also keeps its int64 label in the IDMap
+    return 8 + {"flat": 4 * dim, "hnsw": 4 * dim + graph, "hnsw_sq8": dim + graph, "ivfpq": _pq_m(dim) + 8}[kind]
+
+def choose_index_type(n, dim):
+    """FAISS_INDEX_TYPE, or with "auto" the cheapest type that fits n vectors in the memory budget."""
+    if FAISS_INDEX_TYPE != "auto":
+        assert FAISS_INDEX_TYPE in INDEX_TYPES, f"Unknown FAISS_INDEX_TYPE: {FAISS_INDEX_TYPE}"
+        return FAISS_INDEX_TYPE
+    if n <= FAISS_FLAT_MAX_VECTORS:
+        return "flat"  # exact scan is as fast as a graph search at this size
+    budget = FAISS_MEMORY_BUDGET_MB * 2**20
+    for kind in ("hnsw", "hnsw_sq8"):
+        if n * _bytes_per_vector(kind, dim) <= budget:
+            return kind
+    return "ivfpq"
+
+def index_spec(kind, dim, n, n_train=None):
+    """Factory string and parameters of an index of this type for about n vectors (n_train of them for training)."""
+    if kind == "flat":
+        return {"index_type": kind, "factory": "IDMap,Flat", "params": {}}
+    if kind == "hnsw":
+        return {"index_type": kind, "factory": f"IDMap,HNSW{HNSW_M},Flat", "params": {"M": HNSW_M}}
+    if kind == "hnsw_sq8":
+        return {"index_type": kind, "factory": f"IDMap,HNSW{HNSW_M}_SQ8", "params": {"M": HNSW_M}}
+    # k-means wants ~39 training points per centroid (IVF lists, PQ codes), so both shrink for small n
+    n_train = n_train or n
+    nlist = max(1, min(int(4 * np.sqrt(n)), n_train // 39))
+    nbits = max(1, min(8, int(np.log2(max(n_train // 39, 2)))))
+    m = _pq_m(dim)
+    return {"index_type": kind, "factory": f"IDMap,IVF{nlist},PQ{m}x{nbits}",
+            "params": {"nlist": nlist, "pq_m": m, "nbits": nbits, "nprobe": min(IVF_NPROBE, nlist)}}
+
+def _new_index(spec, dim, train_vectors=None):
+    index = faiss.index_factory(dim, spec["factory"])
+    inner = faiss.downcast_index(index.index)
+    if spec["index_type"].startswith("hnsw"):
+        inner.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+    if spec["index_type"] == "ivfpq":
+        inner.nprobe = spec["params"]["nprobe"]
+    if not index.is_trained:
+        index.train(train_vectors)
+    return index
+
+def search_params(spec, sel=None, ef_search=None):
+    """
+    faiss SearchParameters matching the index type (selector, efSearch, nprobe).
+    ef_search sets the HNSW candidate list size for this query (HNSW_EF_SEARCH when None);
+    FAISS never uses less than k. Other index types ignore it.
+    """
+    kwargs = {"sel": sel} if sel is not None else {}
+    if spec["index_type"].startswith("hnsw"):
+        return faiss.SearchParametersHNSW(efSearch=ef_search or HNSW_EF_SEARCH, **kwargs)
+    if spec["index_type"] == "ivfpq":
+        return faiss.SearchParametersIVF(nprobe=spec["params"]["nprobe"], **kwargs)
+    return faiss.SearchParameters(**kwargs)
+
+def _current_dir(faiss_dir):
+    # readers default to the published snapshot
+    return Path(faiss_dir) if faiss_dir is not None else current_snapshot().faiss_dir
+
+def _persist(index, ids, spec, faiss_dir=FAISS_DIR):
+    faiss_dir = Path(faiss_dir)
+    faiss_dir.mkdir(parents=True, exist_ok=True)
+    # write next to the index and rename: processes that memory-mapped the old file keep a valid mapping
+    idx_path = faiss_dir / "medical_hnsw.index"
+    tmp_path = idx_path.with_name(idx_path.name + ".tmp")
+    faiss.write_index(index, str(tmp_path))
+    os.replace(tmp_path, idx_path)
+    save_npy(faiss_dir / "id_map.npy", np.array(ids, dtype=str))
+    # superseded by id_map.npy
+    (faiss_dir / "id_map.json").unlink(missing_ok=True)
+    # written last: the type, parameters and size of the index next to it
+    write_json(faiss_dir / "index_meta.json", {**spec, "dim": index.d, "ntotal": int(index.ntotal)})
+
+def _has_id_map(faiss_dir):
+    return (Path(faiss_dir) / "id_map.npy").exists() or (Path(faiss_dir) / "id_map.json").exists()
+
+def load_id_map(mmap=FAISS_MMAP, faiss_dir=None):
+    """chunk_id of every FAISS label as a numpy string array; labels are corpus rows, so id_map[label] is the chunk_id."""
+    faiss_dir = _current_dir(faiss_dir)
+    path = faiss_dir / "id_map.npy"
+    if path.exists():
+        return np.load(path, mmap_mode="r" if mmap else None, allow_pickle=False)
+    # indices written before id_map.npy kept a JSON object with string keys
+    legacy = read_json(faiss_dir / "id_map.json")
+    return np.array([legacy[str(i)] for i in range(len(legacy))], dtype=str)
+
+def chunk_ids_for(id_map, labels):
+    """chunk_ids of a row of FAISS hits in rank order; -1 labels (fewer than k results) are dropped."""
+    labels = np.asarray(labels)
+    return id_map.take(labels[labels >= 0])
+
+def load_index_meta(faiss_dir=None):
+    meta_path = _current_dir(faiss_dir) / "index_meta.json"
+    return read_json(meta_path) if meta_path.exists() else dict(_LEGACY_SPEC)
+
+def index_type_outdated(faiss_dir=None):
+    """True when the persisted index should be rebuilt as another type (corpus outgrew it, or FAISS_INDEX_TYPE changed)."""
+    meta_path = _current_dir(faiss_dir) / "index_meta.json"
+    if not meta_path.exists():
+        return False
+    meta = read_json(meta_path)
+    wanted = choose_index_type(meta["ntotal"], meta["dim"])
+    if FAISS_INDEX_TYPE != "auto":
+        return wanted != meta["index_type"]
+    # the corpus only grows: never step back to a smaller type
+    return INDEX_TYPES.index(wanted) > INDEX_TYPES.index(meta["index_type"])
 
-def load_faiss():
-    idx_path = Path(FAISS_DIR) / "medical_hnsw.index"
-    id_map_path = Path(FAISS_DIR) / "id_map.json"
-    assert idx_path.exists() and id_map_path.exists(), "Index not found. Build index first."
+def _batched(items, batch_size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+class IndexOutOfSync(Exception):
+    """The persisted index cannot be extended (missing, other row count or dimension); raised before any chunk is read."""
+
+def _load_for_append(start_label, base_dir, dim):
+    """Persisted index, its spec and chunk ids to append to, or (None, None, []) when starting from label 0."""
+    if start_label == 0:
+        return None, None, []
+    idx_path = Path(base_dir) / "medical_hnsw.index"
+    if not (idx_path.exists() and _has_id_map(base_dir)):
+        raise IndexOutOfSync("Index not found. Build index first.")
     index = faiss.read_index(str(idx_path))
-    id_map = read_json(str(id_map_path))
-    model = SentenceTransformer(EMBEDDING_MODEL)
+    if index.ntotal != start_label:
+        raise IndexOutOfSync(f"Index has {index.ntotal} vectors, the corpus {start_label} rows. Rebuild index first.")
+    if index.d != dim:
+        raise IndexOutOfSync(f"Index dimension {index.d} does not match the embedding model ({dim}). Rebuild index first.")
+    return index, load_index_meta(base_dir), load_id_map(mmap=False, faiss_dir=base_dir).tolist()
+
+def add_to_faiss_index(chunks, start_label, persist=True, batch_size=EMBED_BATCH_SIZE, expected=None,
+                       faiss_dir=FAISS_DIR, base_dir=None):
+    """
+    chunks: iterable of dicts with 'chunk_id' and 'text' (may be a generator fed by the parser)
+    Chunks are encoded in fixed-size batches and each batch is added to the index as soon
+    as it is ready, under labels start_label, start_label+1, ... (their rows in the corpus).
+    start_label 0 starts a new index whose type is chosen for `expected` vectors (when known);
+    quantized types first buffer batches until they have FAISS_TRAIN_SIZE training vectors.
+    Otherwise the index in base_dir (default: faiss_dir) must have exactly start_label rows
+    and the model's dimension, else IndexOutOfSync is raised before chunks is read;
+    the result is written to faiss_dir.
+    returns: index, model, id_map (numpy array of chunk_ids indexed by label)
+    """
+    model = get_embedding_model()
+    index, spec, ids = _load_for_append(start_label, base_dir or faiss_dir, model.get_sentence_embedding_dimension())
+    label = start_label
+    pending = []
+    for batch in _batched(chunks, batch_size):
+        vectors = _encode(model, [c["text"] for c in batch], show_progress_bar=False)
+        labels = np.arange(label, label + len(batch), dtype=np.int64)
+        ids.extend(c["chunk_id"] for c in batch)
+        label += len(batch)
+        pending.append((vectors, labels))
+        if index is None:
+            seen = label - start_label
+            kind = choose_index_type(expected or seen, vectors.shape[1])
+            if kind in ("hnsw_sq8", "ivfpq") and seen < min(expected or FAISS_TRAIN_SIZE, FAISS_TRAIN_SIZE):
+                continue
+            spec = index_spec(kind, vectors.shape[1], max(expected or 0, seen), n_train=seen)
+            index = _new_index(spec, vectors.shape[1], np.concatenate([v for v, _ in pending]))
+        for v, l in pending:
+            index.add_with_ids(v, l)
+        pending = []
+
+    if pending:
+        # the stream ended before enough training vectors were buffered: size the index for what was seen
+        vectors = np.concatenate([v for v, _ in pending])
+        spec = index_spec(choose_index_type(len(vectors), vectors.shape[1]), vectors.shape[1], len(vectors))
+        index = _new_index(spec, vectors.shape[1], vectors)
+        index.add_with_ids(vectors, np.concatenate([l for _, l in pending]))
+
+    if persist and index is not None:
+        _persist(index, ids, spec, faiss_dir)
+
+    return index, model, np.array(ids, dtype=str)
+
+def rebuild_faiss_index(chunks, faiss_dir=FAISS_DIR):
+    """
+    Rebuild the persisted index in faiss_dir as the type its size now calls for, from the
+    vectors it already holds (see stored_vectors): nothing is re-embedded.
+    chunks: the corpus in row order. returns the new index spec.
+    """
+    old = read_faiss_index(mmap=False, faiss_dir=faiss_dir)
+    if old.ntotal != len(chunks):
+        raise IndexOutOfSync(f"Index has {old.ntotal} vectors, the corpus {len(chunks)} rows. Rebuild index first.")
+    vectors = stored_vectors(old, load_index_meta(faiss_dir), 0, old.ntotal, [c["text"] for c in chunks])
+    n, dim = vectors.shape
+    spec = index_spec(choose_index_type(n, dim), dim, n, n_train=min(n, FAISS_TRAIN_SIZE))
+    index = _new_index(spec, dim, vectors[:FAISS_TRAIN_SIZE])
+    index.add_with_ids(vectors, np.arange(n, dtype=np.int64))
+    _persist(index, [c["chunk_id"] for c in chunks], spec, faiss_dir)
+    return spec
+
+def build_faiss_index(chunks, persist=True, faiss_dir=FAISS_DIR):
+    """
+    chunks: iterable of dicts with 'chunk_id' and 'text'
+    returns: index, model, id_map
+    """
+    expected = len(chunks) if hasattr(chunks, "__len__") else None
+    return add_to_faiss_index(chunks, start_label=0, persist=persist, expected=expected, faiss_dir=faiss_dir)
+
+def _mmap_flags(spec):
+    # IVF inverted lists and flat code arrays (Flat, HNSW storage, SQ8) are mmapped by different flags
+    mmap = faiss.IO_FLAG_MMAP if spec["index_type"] == "ivfpq" else faiss.IO_FLAG_MMAP_IFC
+    return mmap | faiss.IO_FLAG_READ_ONLY
+
+def read_faiss_index(mmap=FAISS_MMAP, faiss_dir=None):
+    """
+    Read the persisted index (default: the current snapshot's). With mmap the bulk of it
+    (vectors/codes) stays in the page cache and is shared by every process that opens it;
+    falls back to a private copy when the index format cannot be mapped.
+    """
+    faiss_dir = _current_dir(faiss_dir)
+    idx_path = faiss_dir / "medical_hnsw.index"
+    if mmap:
+        try:
+            return faiss.read_index(str(idx_path), _mmap_flags(load_index_meta(faiss_dir)))
+        except RuntimeError as e:
+            print(f"Index cannot be memory-mapped, reading it into memory: {str(e).splitlines()[0]}")
+    return faiss.read_index(str(idx_path))
+
+def load_faiss(mmap=FAISS_MMAP, faiss_dir=None):
+    faiss_dir = _current_dir(faiss_dir)
+    idx_path = faiss_dir / "medical_hnsw.index"
+    assert idx_path.exists() and _has_id_map(faiss_dir), "Index not found. Build index first."
+    index = read_faiss_index(mmap=mmap, faiss_dir=faiss_dir)
+    id_map = load_id_map(mmap=mmap, faiss_dir=faiss_dir)
+    model = get_embedding_model()
     return index, model, id_map
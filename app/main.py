@@ -1,11 +1,8 @@
 import streamlit as st
-from .pdf_parser import extract_text_pages
-from .chunking import chunk_pages
-from .indexer import build_faiss_index
-from .bm25_search import build_bm25
+from .corpus import ingest_pdf, lookup_document
 from .retrieval import hybrid_search
 from .summarizer import map_reduce_summarize
-from .utils import write_json
+from .utils import write_json, content_hash
 from .config import FAISS_DIR, META_DIR
 from pathlib import Path
 import os, json, time
@@ -280,34 +277,33 @@ else:
     # Statistics container
     stats_container = st.empty()
     
-    tmp_path = "temp_uploaded.pdf"
-    with open(tmp_path, "wb") as f:
-        f.write(uploaded.read())
+    content = uploaded.getvalue()
+    pdf_hash = content_hash(content)
+    cached = lookup_document(pdf_hash)
+
+    if cached:
+        # Same PDF bytes as an earlier upload: reuse its pages, chunks and index entries
+        document, pages, chunks = cached
+        st.info("♻️ This report was analyzed before - reusing its extracted text and search index entries")
+        progress_bar.progress(65)
+    else:
+        # Steps 1-4: Streaming ingestion
+        status_text.markdown("""
+        <div class="step-container">
+            <h4><span class="processing-spinner"></span> Steps 1-4: Extracting, Chunking &amp; Indexing</h4>
+            <p>Streaming pages into recursive chunking and batched FAISS/BM25 indexing...</p>
+        </div>
+        """, unsafe_allow_html=True)
+        progress_bar.progress(15)
+    
+        Path(META_DIR).mkdir(parents=True, exist_ok=True)
+        document, pages, chunks = ingest_pdf(content, filename=uploaded.name, doc_hash=pdf_hash)
+        if document is None:
+            st.error("Could not extract text from PDF")
+            st.stop()
+        progress_bar.progress(65)
+        time.sleep(0.5)
 
-    # Step 1: Extract pages
-    status_text.markdown("""
-    <div class="step-container">
-        <h4><span class="processing-spinner"></span> Step 1: Extracting Document Pages</h4>
-        <p>Processing PDF structure and extracting text content...</p>
-    </div>
-    """, unsafe_allow_html=True)
-    progress_bar.progress(15)
-    
-    pages = extract_text_pages(tmp_path)
-    time.sleep(0.5)  # Animation delay
-    
-    # Step 2: Chunking
-    status_text.markdown("""
-    <div class="step-container">
-        <h4><span class="processing-spinner"></span> Step 2: Intelligent Text Chunking</h4>
-        <p>Applying recursive chunking with overlap for optimal context preservation...</p>
-    </div>
-    """, unsafe_allow_html=True)
-    progress_bar.progress(30)
-    
-    chunks = chunk_pages(pages)
-    time.sleep(0.5)
-    
     # Display statistics
     stats_container.markdown(f"""
     <div class="stats-grid">
@@ -326,34 +322,6 @@ else:
     </div>
     """, unsafe_allow_html=True)
 
-    # Persist chunk metadata
-    Path(META_DIR).mkdir(parents=True, exist_ok=True)
-    write_json(Path(META_DIR)/"chunks.json", chunks)
-
-    # Step 3: Build FAISS index
-    status_text.markdown("""
-    <div class="step-container">
-        <h4><span class="processing-spinner"></span> Step 3: Building Neural Search Index</h4>
-        <p>Creating FAISS HNSW embeddings for semantic similarity search...</p>
-    </div>
-    """, unsafe_allow_html=True)
-    progress_bar.progress(50)
-    
-    index, emb_model, id_map = build_faiss_index(chunks, persist=True)
-    time.sleep(0.5)
-
-    # Step 4: Build BM25 index
-    status_text.markdown("""
-    <div class="step-container">
-        <h4><span class="processing-spinner"></span> Step 4: Building Lexical Search Index</h4>
-        <p>Creating BM25 index for keyword-based retrieval...</p>
-    </div>
-    """, unsafe_allow_html=True)
-    progress_bar.progress(65)
-    
-    bm25, ids = build_bm25(chunks, persist=True)
-    time.sleep(0.5)
-
     # Step 5: Hybrid retrieval
     status_text.markdown("""
     <div class="step-container">
@@ -363,7 +331,7 @@ else:
     """, unsafe_allow_html=True)
     progress_bar.progress(80)
     
-    retrieved = hybrid_search("Summarize full report comprehensively", META_DIR)
+    retrieved = hybrid_search("Summarize full report comprehensively", META_DIR, doc_id=document["doc_id"])
     
     # Ensure full coverage
     all_chunk_ids = [c["chunk_id"] for c in chunks]
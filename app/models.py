@@ -0,0 +1,30 @@
+from sentence_transformers import SentenceTransformer, CrossEncoder
+from .config import EMBEDDING_MODEL, CROSS_ENCODER_MODEL
+import threading
+
+# process-wide model registry: each model is constructed once and shared by
+# the indexer, the retriever, the reranker and the extractive summarizer
+_models = {}
+_lock = threading.Lock()
+
+def _get(kind, name, factory):
+    key = (kind, name)
+    model = _models.get(key)
+    if model is None:
+        with _lock:
+            model = _models.get(key)
+            if model is None:
+                model = factory(name)
+                _models[key] = model
+    return model
+
+def get_embedding_model(name=EMBEDDING_MODEL):
+    return _get("embedding", name, SentenceTransformer)
+
+def get_cross_encoder(name=CROSS_ENCODER_MODEL):
+    return _get("cross_encoder", name, CrossEncoder)
+
+def warmup():
+    """Load the default models and run one dummy forward pass through each."""
+    get_embedding_model().encode(["warmup"], convert_to_numpy=True)
+    get_cross_encoder().predict([["warmup", "warmup"]])
@@ -1,21 +1,146 @@
 import fitz  # PyMuPDF
-from .utils import make_id
-import re
+from concurrent.futures import ProcessPoolExecutor
+from .config import PDF_PARSE_WORKERS, PDF_PARALLEL_MIN_PAGES, BOILERPLATE_MIN_FRACTION, BOILERPLATE_MIN_PAGES
+from .utils import stable_id, text_hash, content_hash
+from collections import Counter
+import math, re
 
-def extract_text_pages(file_path):
+def _clean(raw):
+    # basic cleanup: remove multiple blank lines, normalize spacing
+    text = re.sub(r'\r\n?', '\n', raw)
+    return re.sub(r'\n{2,}', '\n\n', text).strip()
+
+def _is_buffer(source):
+    return isinstance(source, (bytes, bytearray, memoryview))
+
+def _open(source):
+    """Open a PDF from a file path or directly from an in-memory buffer (no temp file)."""
+    if _is_buffer(source):
+        return fitz.open(stream=source, filetype="pdf")
+    return fitz.open(source)
+
+_worker_source = None
+
+def _init_worker(source):
+    # the source (path or bytes) is sent once per worker process, not once per page range
+    global _worker_source
+    _worker_source = source
+
+def _extract_range(start, stop):
+    """Worker: open the document independently and return cleaned text of pages [start, stop)."""
+    with _open(_worker_source) as pdf:
+        return [_clean(pdf[i].get_text("text")) for i in range(start, stop)]
+
+def _page_ranges(num_pages, workers):
+    # a few slices per worker keeps the pool busy when some pages are much heavier than others
+    n_slices = min(num_pages, workers * 4)
+    bounds = [round(k * num_pages / n_slices) for k in range(n_slices + 1)]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+def iter_text_pages(source, doc_hash=None, workers=PDF_PARSE_WORKERS):
+    """
+    source: path to a PDF file, or the PDF itself as bytes/bytearray/memoryview.
+    Yields pages {page_index:int, text:str, page_id:str} in document order as they are extracted.
+    page_id is derived from the document hash (sha256 of the PDF bytes), page index and text hash.
+    With workers > 1 and at least PDF_PARALLEL_MIN_PAGES pages, pages are extracted in a
+    process pool; the result is identical to the serial path.
+    """
+    if doc_hash is None:
+        if _is_buffer(source):
+            doc_hash = content_hash(source)
+        else:
+            with open(source, "rb") as f:
+                doc_hash = content_hash(f.read())
+    if isinstance(source, memoryview):
+        # worker processes need a picklable buffer
+        source = source if workers <= 1 else source.tobytes()
+    with _open(source) as pdf:
+        num_pages = len(pdf)
+        if workers > 1 and num_pages >= PDF_PARALLEL_MIN_PAGES:
+            texts = None
+        else:
+            texts = (_clean(pdf[i].get_text("text")) for i in range(num_pages))
+            yield from _pages(texts, doc_hash)
+    if texts is None:
+        ranges = _page_ranges(num_pages, workers)
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(source,)) as pool:
+            # map preserves submission order, so pages come back in document order
+            parts = pool.map(_extract_range, [a for a, _ in ranges], [b for _, b in ranges])
+            yield from _pages((t for part in parts for t in part), doc_hash)
+
+def _pages(texts, doc_hash):
+    for i, text in enumerate(texts):
+        if not text:
+            continue
+        yield {"page_index": i+1, "text": text, "page_id": stable_id("p", doc_hash, i+1, text_hash(text))}
+
+def extract_text_pages(source, doc_hash=None, workers=PDF_PARSE_WORKERS):
     """
     Returns list of pages: [{page_index:int, text:str, page_id:str}]
     We keep original page boundaries for traceability.
+    source is a file path or the PDF bytes.
+    """
+    return list(iter_text_pages(source, doc_hash=doc_hash, workers=workers))
+
+_PAGE_NUMBER = re.compile(r'^[\W_]*(page|pg\.?|p\.)?\s*\d+\s*((of|/)\s*\d+)?[\W_]*$', re.IGNORECASE)
+_MARGIN_LINES = 3
+
+def _line_keys(text):
+    """Lines, their normalized keys (None for blank lines) and the indices of the header/footer lines."""
+    lines = text.split("\n")
+    filled = [i for i, line in enumerate(lines) if line.strip()]
+    margin = set(filled[:_MARGIN_LINES] + filled[-_MARGIN_LINES:])
+    keys = []
+    for i, line in enumerate(lines):
+        if not line.strip():
+            keys.append(None)
+            continue
+        key = " ".join(line.lower().split())
+        # page numbers differ on every page: "- 1 -", "Page 2 of 9" and "3/9" share one key when
+        # they sit in the header/footer lines; anything else must repeat verbatim, so lab rows
+        # or table cells that differ only in their values are kept
+        if i in margin and _PAGE_NUMBER.match(key):
+            key = "<page-number>"
+        keys.append(key)
+    return lines, keys, margin
+
+def strip_boilerplate(pages, min_fraction=BOILERPLATE_MIN_FRACTION, min_pages=BOILERPLATE_MIN_PAGES):
     """
-    pages = []
-    with fitz.open(file_path) as pdf:
-        for i in range(len(pdf)):
-            page = pdf[i]
-            raw = page.get_text("text")
-            # basic cleanup: remove multiple blank lines, normalize spacing
-            text = re.sub(r'\r\n?', '\n', raw)
-            text = re.sub(r'\n{2,}', '\n\n', text).strip()
-            if not text:
-                continue
-            pages.append({"page_index": i+1, "text": text, "page_id": make_id("p")})
-    return pages
+    Document-level pass removing header/footer lines repeated on most pages (letterheads,
+    page numbers, disclaimers, patient banners) before chunking.
+    Only the first and last _MARGIN_LINES non-blank lines of a page are candidates; one is
+    boilerplate when its normalized form sits there on at least min_fraction of the distinct
+    pages. Pages repeated verbatim (a lab sheet attached three times) count once, so their
+    content is left for chunk dedup, and a page is never stripped down to nothing.
+    Documents with fewer than min_pages pages are left unchanged.
+    page_id is kept (it identifies the extracted page); chunk offsets refer to the stripped text.
+    returns (pages, stats) with stats {"lines_removed", "chars_removed", "chars_before"}
+    """
+    stats = {"lines_removed": 0, "chars_removed": 0, "chars_before": sum(len(p["text"]) for p in pages)}
+    if len(pages) < min_pages:
+        return pages, stats
+    split = [_line_keys(p["text"]) for p in pages]
+    counts, seen = Counter(), set()
+    for _, keys, margin in split:
+        signature = tuple(k for k in keys if k is not None)
+        if signature in seen:
+            continue
+        seen.add(signature)
+        counts.update({keys[i] for i in margin})
+    threshold = max(2, math.ceil(min_fraction * len(seen)))
+    boilerplate = {key for key, n in counts.items() if n >= threshold}
+    if not boilerplate:
+        return pages, stats
+
+    cleaned = []
+    for p, (lines, keys, margin) in zip(pages, split):
+        kept = [line for i, (line, key) in enumerate(zip(lines, keys)) if i not in margin or key not in boilerplate]
+        text = _clean("\n".join(kept))
+        if not text:
+            # nothing but header/footer lines: keep the page as extracted
+            cleaned.append(p)
+            continue
+        stats["lines_removed"] += len(lines) - len(kept)
+        stats["chars_removed"] += len(p["text"]) - len(text)
+        cleaned.append({**p, "text": text})
+    return cleaned, stats
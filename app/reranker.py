@@ -1,20 +1,24 @@
-from sentence_transformers import CrossEncoder
-from .config import CROSS_ENCODER_MODEL
+import numpy as np
+from .models import get_cross_encoder
+from .utils import top_k_indices
 from tqdm import tqdm
 
-_cross_encoder = None
+def rerank(query, candidates, top_k=None):
+    """
+    candidates: (chunk_id, text, score) records. Returns the top_k of them (all when None)
+    as (chunk_id, text, cross-encoder score) records, best first.
+    """
+    return rerank_many([query], [candidates], top_k=top_k)[0]
 
-def get_cross_encoder():
-    global _cross_encoder
-    if _cross_encoder is None:
-        _cross_encoder = CrossEncoder(CROSS_ENCODER_MODEL)
-    return _cross_encoder
-
-def rerank(query, candidate_texts, top_k=None):
+def rerank_many(queries, candidate_lists, top_k=None):
+    """rerank for several queries with one cross-encoder predict over every (query, candidate) pair."""
     model = get_cross_encoder()
-    pairs = [[query, txt] for txt in candidate_texts]
-    scores = model.predict(pairs)
-    ranked = sorted(zip(candidate_texts, scores), key=lambda x: x[1], reverse=True)
-    if top_k:
-        ranked = ranked[:top_k]
-    return [t for t,s in ranked], [s for t,s in ranked]
+    pairs = [[query, text] for query, candidates in zip(queries, candidate_lists) for _, text, _ in candidates]
+    scores = np.asarray(model.predict(pairs), dtype=np.float32) if pairs else np.empty(0, dtype=np.float32)
+    results, pos = [], 0
+    for candidates in candidate_lists:
+        row = scores[pos:pos + len(candidates)]
+        pos += len(candidates)
+        idx = top_k_indices(row, top_k or len(candidates))
+        results.append([(candidates[i][0], candidates[i][1], float(row[i])) for i in idx])
+    return results
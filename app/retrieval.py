@@ -1,11 +1,89 @@
 import numpy as np
-from .indexer import load_faiss
+import faiss
+from .indexer import load_faiss, load_index_meta, search_params, chunk_ids_for, cached_rows, cached_vectors
 from .bm25_search import load_bm25
-from .reranker import rerank
-from .config import TOP_K_DENSE, TOP_K_BM25, RE_RANK_K
-from .utils import read_json, log_event
+from .reranker import rerank_many
+from .fusion import fuse
+from .config import (TOP_K_DENSE, TOP_K_BM25, RE_RANK_K, RERANK_BUDGET, META_DIR, EMBEDDING_MODEL, QUERY_CACHE_SIZE, QUERY_CACHE_TTL,
+                     QUERY_EMBEDDING_CACHE_SIZE, QUERY_EMBEDDING_CACHE_TTL, RETRIEVAL_WORKERS, DENSE_LEG_TIMEOUT,
+                     BM25_LEG_TIMEOUT)
+from .embedding_cache import text_key
+from .query_cache import LRUCache
+from .snapshots import current_snapshot
+from .utils import read_json, log_event, top_k_indices
 from pathlib import Path
-import json
+import json, threading, time
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+class UnknownDocument(LookupError):
+    """doc_id of a search is not in the pinned snapshot."""
+
+# per-process caches: query text key -> embedding, and (snapshot, query, options) -> ranked chunks
+_query_vectors = LRUCache(QUERY_EMBEDDING_CACHE_SIZE, QUERY_EMBEDDING_CACHE_TTL)
+_query_results = LRUCache(QUERY_CACHE_SIZE, QUERY_CACHE_TTL)
+
+# shared by all retrievers and requests of this process
+_leg_pool = ThreadPoolExecutor(max_workers=RETRIEVAL_WORKERS, thread_name_prefix="retrieval")
+
+_leg_stats = {"dense": {"runs": 0, "dropped": 0}, "bm25": {"runs": 0, "dropped": 0}}
+_leg_lock = threading.Lock()
+
+def query_cache_stats():
+    return {"results": _query_results.stats(), "embeddings": _query_vectors.stats()}
+
+def leg_stats():
+    """Runs and timeouts per retrieval leg (per process)."""
+    with _leg_lock:
+        return {name: {**counts, "drop_rate": round(counts["dropped"] / counts["runs"], 4) if counts["runs"] else 0.0}
+                for name, counts in _leg_stats.items()}
+
+class _LegTimeout(Exception):
+    pass
+
+_leg_local = threading.local()
+
+def _check_deadline():
+    # lets a leg that already lost its query give its pool worker back between stages
+    deadline = getattr(_leg_local, "deadline", None)
+    if deadline is not None and time.monotonic() > deadline:
+        raise _LegTimeout()
+
+class _Leg:
+    """
+    One retrieval leg running in _leg_pool, with a budget of its timeout per query of the batch.
+    Waiting for a worker is bounded by the budget from submission (a leg still queued then never runs), and
+    running is bounded by the budget counted from when a worker picks it up, so neither a busy
+    pool nor a large batch can make the leg's query wait indefinitely.
+    """
+
+    def __init__(self, fn, timeout, num_queries, *args):
+        self.budget = timeout * num_queries
+        self.queued_until = time.monotonic() + self.budget
+        self.deadline = None
+        self._abandoned = False
+        self._started = threading.Event()
+        self.future = _leg_pool.submit(self._run, fn, *args)
+
+    def _run(self, fn, *args):
+        if self._abandoned or (self.budget > 0 and time.monotonic() > self.queued_until):
+            raise _LegTimeout()
+        self.deadline = time.monotonic() + self.budget if self.budget > 0 else None
+        self._started.set()
+        _leg_local.deadline = self.deadline
+        try:
+            return fn(*args)
+        finally:
+            _leg_local.deadline = None
+
+    def result(self):
+        if self.budget <= 0:
+            return self.future.result()
+        if not self._started.wait(max(0.0, self.queued_until - time.monotonic())):
+            self._abandoned = True
+            self.future.cancel()
+            raise _LegTimeout()
+        return self.future.result(timeout=max(0.0, self.deadline - time.monotonic()))
 
 # helper to fetch chunk texts from metadata store (metadata stored separately)
 def load_chunk_metadata(meta_dir):
@@ -19,52 +97,232 @@ def load_chunk_metadata(meta_dir):
         all_chunks.extend(json.loads(open(f,'r',encoding='utf-8').read()))
     return all_chunks
 
-def hybrid_search(query, meta_dir, top_k_dense=TOP_K_DENSE, top_k_bm25=TOP_K_BM25, re_rank_k=RE_RANK_K):
-    index, emb_model, id_map = load_faiss()
-    bm25, bm25_ids = load_bm25()
-    chunks = load_chunk_metadata(meta_dir)
-    id_to_chunk = {c["chunk_id"]: c for c in chunks}
-
-    # dense search
-    q_vec = emb_model.encode([query], convert_to_numpy=True)
-    distances, indices = index.search(q_vec.astype(np.float32), top_k_dense)
-    
-    # handle mapping type: id_map keys can be either string or int
-    dense_chunk_ids = []
-    for i in indices[0]:
-        if i < len(id_map):  # Ensure index is valid
-            # Try different key formats
-            chunk_id = None
-            if str(i) in id_map:
-                chunk_id = id_map[str(i)]
-            elif int(i) in id_map:
-                chunk_id = id_map[int(i)]
-            elif i in id_map:
-                chunk_id = id_map[i]
-            
-            if chunk_id is not None:
-                dense_chunk_ids.append(chunk_id)
-
-    # bm25 search
-    tokens = query.split()
-    bm25_scores = bm25.get_scores(tokens)
-    top_bm25_idx = list(np.argsort(bm25_scores)[-top_k_bm25:][::-1])
-    bm25_chunk_ids = [bm25_ids[i] for i in top_bm25_idx]
-
-    # union candidate ids (preserve order)
-    candidate_ids = []
-    for cid in dense_chunk_ids + bm25_chunk_ids:
-        if cid and cid not in candidate_ids:
-            candidate_ids.append(cid)
-
-    candidate_texts = [id_to_chunk[cid]["text"] for cid in candidate_ids if cid in id_to_chunk]
-
-    # re-rank top N
-    reranked_texts, scores = rerank(query, candidate_texts[:re_rank_k], top_k=re_rank_k)
-    final_candidates = reranked_texts
-
-    # return chunk objects in final order
-    final_chunk_objs = [id_to_chunk[next(cid for cid in candidate_ids if id_to_chunk[cid]["text"]==txt)] for txt in final_candidates]
-    # log
-    log_event("retrieval", {"query": query, "candidates": [c["chunk_id"] for c in final_chunk_objs]})
-    return final_chunk_objs
+class Retriever:
+    """
+    Long-lived holder of the FAISS index, embedding model, BM25 state and chunk table of
+    the current snapshot. A snapshot is loaded once and replaced when CURRENT moves on;
+    each query runs entirely against the snapshot it started with.
+    """
+
+    def __init__(self, meta_dir=META_DIR):
+        self.meta_dir = Path(meta_dir)
+        self._state = None
+        self._lock = threading.Lock()
+
+    def _artifact_paths(self, snapshot):
+        return [
+            snapshot.faiss_dir / "medical_hnsw.index",
+            snapshot.faiss_dir / "id_map.npy",
+            snapshot.faiss_dir / "index_meta.json",
+            snapshot.bm25_dir / "bm25.json",
+            snapshot.meta_dir / "chunks.json",
+            snapshot.meta_dir / "documents.json",
+        ]
+
+    def _stamp(self, snapshot):
+        # published snapshots never change, so the version identifies the artifacts
+        if snapshot.version is not None:
+            return snapshot.version
+        # flat layout written before the first snapshot: files change in place
+        stamp = []
+        for p in self._artifact_paths(snapshot):
+            try:
+                st = p.stat()
+                stamp.append((st.st_mtime_ns, st.st_size))
+            except FileNotFoundError:
+                stamp.append(None)
+        return tuple(stamp)
+
+    def _load(self, snapshot, stamp):
+        index, emb_model, id_map = load_faiss(faiss_dir=snapshot.faiss_dir)
+        bm25, bm25_ids = load_bm25(snapshot.bm25_dir)
+        chunks = load_chunk_metadata(snapshot.meta_dir)
+        docs_path = snapshot.meta_dir / "documents.json"
+        documents = read_json(docs_path) if docs_path.exists() else []
+        return {
+            "stamp": stamp,
+            "version": snapshot.version,
+            "index": index,
+            "index_meta": load_index_meta(snapshot.faiss_dir),
+            "model": emb_model,
+            "id_map": id_map,
+            "bm25": bm25,
+            "bm25_ids": bm25_ids,
+            "id_to_chunk": {c["chunk_id"]: c for c in chunks},
+            # corpus rows [start, end) of every document; rows are FAISS labels and BM25 columns
+            "doc_rows": {d["doc_id"]: (d["first_row"], d["first_row"] + d["num_chunks"]) for d in documents},
+            # (start, stop) -> embedding cache rows of a document, for IVF-PQ doc-scoped search
+            "cache_rows": {},
+        }
+
+    def state(self):
+        """Return the state of the current snapshot, loading it if CURRENT moved since the last call."""
+        snapshot = current_snapshot(self.meta_dir)
+        stamp = self._stamp(snapshot)
+        state = self._state
+        if state is not None and state["stamp"] == stamp:
+            return state
+        with self._lock:
+            state = self._state
+            if state is None or state["stamp"] != stamp:
+                # build the new state fully before swapping so readers never see a partial reload
+                state = self._load(snapshot, stamp)
+                self._state = state
+        return state
+
+    def search(self, query, top_k_dense=TOP_K_DENSE, top_k_bm25=TOP_K_BM25, re_rank_k=RE_RANK_K, doc_id=None, ef_search=None,
+               rerank_budget=RERANK_BUDGET):
+        """
+        Hybrid search over the whole corpus, or only within one document when doc_id is given.
+        Dense and BM25 candidates are fused (FUSION_METHOD) and the best rerank_budget of them
+        are scored by the cross-encoder; the re_rank_k best chunks are returned with their "score".
+        ef_search trades dense recall for latency on HNSW indices (see tune_ef_search.py); within
+        one document the dense leg is an exact scan of its rows, so it does not apply there.
+        """
+        return self.search_many([query], top_k_dense=top_k_dense, top_k_bm25=top_k_bm25, re_rank_k=re_rank_k,
+                                doc_id=doc_id, ef_search=ef_search, rerank_budget=rerank_budget)[0]
+
+    def search_many(self, queries, top_k_dense=TOP_K_DENSE, top_k_bm25=TOP_K_BM25, re_rank_k=RE_RANK_K, doc_id=None, ef_search=None,
+                    rerank_budget=RERANK_BUDGET):
+        """
+        Hybrid search for several queries at once (same options as search): one encoder batch,
+        one FAISS search over the query matrix, one sparse BM25 product and one cross-encoder
+        predict for all (query, candidate) pairs. returns one result list per query.
+        Ranked results are cached per snapshot, so a new snapshot never serves stale results.
+        """
+        queries = list(queries)
+        if not queries:
+            return []
+        # pin one snapshot for the whole batch
+        state = self.state()
+        rows = None
+        if doc_id is not None:
+            if doc_id not in state["doc_rows"]:
+                raise UnknownDocument(f"Unknown document: {doc_id}")
+            rows = state["doc_rows"][doc_id]
+
+        keys = [text_key(q) for q in queries]
+        cache_keys = [(state["stamp"], key, top_k_dense, top_k_bm25, re_rank_k, doc_id, ef_search, rerank_budget) for key in keys]
+        results = [_query_results.get(k) for k in cache_keys]
+        todo = [i for i, r in enumerate(results) if r is None]
+        if todo:
+            computed, dropped = self._rank(state, [queries[i] for i in todo], [keys[i] for i in todo], rows,
+                                           top_k_dense, top_k_bm25, re_rank_k, ef_search, rerank_budget)
+            for i, chunk_objs in zip(todo, computed):
+                results[i] = chunk_objs
+                # results missing a dropped leg are not cached
+                if not dropped:
+                    _query_results.put(cache_keys[i], chunk_objs)
+        else:
+            dropped = []
+
+        for i, (query, chunk_objs) in enumerate(zip(queries, results)):
+            log_event("retrieval", {"query": query, "snapshot": state["version"], "cached": i not in todo,
+                                    "dropped_legs": dropped if i in todo else [],
+                                    "candidates": [c["chunk_id"] for c in chunk_objs]})
+        # callers may extend the returned lists; the cached ones stay untouched
+        return [list(chunk_objs) for chunk_objs in results]
+
+    def _encode_queries(self, emb_model, queries, keys):
+        vectors = [_query_vectors.get((EMBEDDING_MODEL, key)) for key in keys]
+        missing = [i for i, v in enumerate(vectors) if v is None]
+        if missing:
+            encoded = emb_model.encode([queries[i] for i in missing], convert_to_numpy=True).astype(np.float32)
+            for i, v in zip(missing, encoded):
+                vectors[i] = v
+                _query_vectors.put((EMBEDDING_MODEL, keys[i]), v)
+        return np.stack(vectors)
+
+    def _dense_leg(self, state, queries, keys, rows, top_k_dense, ef_search):
+        index, id_map = state["index"], state["id_map"]
+        q_vecs = self._encode_queries(state["model"], queries, keys)
+        _check_deadline()
+        if rows is not None:
+            return self._scan_rows(state, q_vecs, rows, top_k_dense)
+        params = search_params(state["index_meta"], ef_search=ef_search)
+        distances, indices = index.search(q_vecs, top_k_dense, params=params)
+        # L2 distances of normalized embeddings: a smaller distance is a higher score
+        return [(chunk_ids_for(id_map, row).tolist(), -dist[row >= 0]) for dist, row in zip(distances, indices)]
+
+    def _scan_rows(self, state, q_vecs, rows, top_k_dense):
+        """
+        Exact search over the corpus rows [start, stop) of one document. A filtered graph
+        search rarely reaches a small row range, so one document's vectors are scanned instead:
+        read back from the index (labels are positions in it), or for IVF-PQ, whose codes are
+        lossy and not addressable by position, read from the embedding cache (never re-encoded).
+        """
+        start, stop = rows
+        ids = state["id_map"][start:stop]
+        if state["index_meta"]["index_type"] == "ivfpq":
+            # resolving cache rows hashes every chunk text: once per document and snapshot
+            cache_rows = state["cache_rows"].get(rows)
+            if cache_rows is None:
+                cache_rows = state["cache_rows"][rows] = cached_rows([state["id_to_chunk"][cid]["text"] for cid in ids])
+            vectors = cached_vectors(cache_rows)
+        else:
+            vectors = faiss.downcast_index(state["index"].index).reconstruct_n(start, stop - start)
+        distances = (q_vecs ** 2).sum(1)[:, None] - 2 * q_vecs @ vectors.T + (vectors ** 2).sum(1)[None, :]
+        return [(ids[idx].tolist(), -row[idx]) for row in distances for idx in [top_k_indices(-row, top_k_dense)]]
+
+    def _bm25_leg(self, state, queries, rows, top_k_bm25):
+        bm25_ids = state["bm25_ids"]
+        tokens = [query.split() for query in queries]
+        start, stop = rows if rows is not None else (0, None)
+        return [([bm25_ids[i] for i in idx], scores) for idx, scores in state["bm25"].top_k_many(tokens, top_k_bm25, start, stop)]
+
+    def _rank(self, state, queries, keys, rows, top_k_dense, top_k_bm25, re_rank_k, ef_search, rerank_budget):
+        """Ranked chunks per query, plus the names of legs dropped for exceeding their timeout."""
+        id_to_chunk = state["id_to_chunk"]
+
+        # dense and bm25 legs run concurrently (FAISS, torch and numpy release the GIL)
+        legs = {
+            "dense": _Leg(self._dense_leg, DENSE_LEG_TIMEOUT, len(queries), state, queries, keys, rows, top_k_dense, ef_search),
+            "bm25": _Leg(self._bm25_leg, BM25_LEG_TIMEOUT, len(queries), state, queries, rows, top_k_bm25),
+        }
+        leg_ids, dropped = {}, []
+        for name, leg in legs.items():
+            try:
+                leg_ids[name] = leg.result()
+            except (FutureTimeout, _LegTimeout):
+                # a leg past its deadline stops at its next stage boundary; this query goes on without it
+                # (the drop is in the retrieval log event and in leg_stats)
+                dropped.append(name)
+                leg_ids[name] = [([], []) for _ in queries]
+        with _leg_lock:
+            for name in legs:
+                _leg_stats[name]["runs"] += 1
+                _leg_stats[name]["dropped"] += name in dropped
+
+        # fuse both legs by score, then send the best rerank_budget candidates to the cross-encoder
+        candidates = []
+        for dense, sparse in zip(leg_ids["dense"], leg_ids["bm25"]):
+            fused_ids, fused_scores = fuse(dense, sparse)
+            records = ((cid, id_to_chunk[cid]["text"], float(score)) for cid, score in zip(fused_ids, fused_scores) if cid in id_to_chunk)
+            candidates.append(list(islice(records, rerank_budget)))
+
+        # re-rank the budget of every query in one batch; chunk objects in final order, with the cross-encoder score
+        reranked = rerank_many(queries, candidates, top_k=re_rank_k)
+        results = [[{**id_to_chunk[cid], "score": score} for cid, _, score in records] for records in reranked]
+        return results, dropped
+
+_retrievers = {}
+_retrievers_lock = threading.Lock()
+
+def get_retriever(meta_dir=META_DIR):
+    """Process-wide Retriever per metadata directory."""
+    key = str(Path(meta_dir).resolve())
+    with _retrievers_lock:
+        if key not in _retrievers:
+            _retrievers[key] = Retriever(meta_dir)
+        return _retrievers[key]
+
+def hybrid_search(query, meta_dir, top_k_dense=TOP_K_DENSE, top_k_bm25=TOP_K_BM25, re_rank_k=RE_RANK_K, doc_id=None, ef_search=None,
+                  rerank_budget=RERANK_BUDGET):
+    return get_retriever(meta_dir).search(query, top_k_dense=top_k_dense, top_k_bm25=top_k_bm25, re_rank_k=re_rank_k,
+                                          doc_id=doc_id, ef_search=ef_search, rerank_budget=rerank_budget)
+
+def hybrid_search_many(queries, meta_dir, top_k_dense=TOP_K_DENSE, top_k_bm25=TOP_K_BM25, re_rank_k=RE_RANK_K, doc_id=None, ef_search=None,
+                       rerank_budget=RERANK_BUDGET):
+    """hybrid_search for a list of queries in one batch; returns one result list per query."""
+    return get_retriever(meta_dir).search_many(queries, top_k_dense=top_k_dense, top_k_bm25=top_k_bm25, re_rank_k=re_rank_k,
+                                               doc_id=doc_id, ef_search=ef_search, rerank_budget=rerank_budget)
@@ -0,0 +1,84 @@
+import os, re, shutil, threading
+from contextlib import contextmanager
+from pathlib import Path
+from .config import FAISS_DIR, BM25_DIR, META_DIR, SNAPSHOT_DIR, SNAPSHOT_KEEP
+from .utils import file_lock
+
+Path(SNAPSHOT_DIR).mkdir(parents=True, exist_ok=True)
+
+_VERSION = re.compile(r"v(\d+)")
+_writer_lock = threading.Lock()
+
+class Snapshot:
+    """
+    One complete set of index artifacts: FAISS index + id map, BM25 arrays and the chunk
+    table (chunks.json, documents.json). A published snapshot is never modified; each
+    ingestion writes a new one and moves the CURRENT pointer to it.
+    """
+
+    def __init__(self, version, faiss_dir, bm25_dir, meta_dir):
+        self.version = version
+        self.faiss_dir = Path(faiss_dir)
+        self.bm25_dir = Path(bm25_dir)
+        self.meta_dir = Path(meta_dir)
+
+    @classmethod
+    def at(cls, path):
+        path = Path(path)
+        return cls(path.name, path / "faiss_index", path / "bm25_index", path / "metadata")
+
+    @property
+    def path(self):
+        return Path(SNAPSHOT_DIR) / self.version
+
+def current_version():
+    """Version named by the CURRENT pointer, or None before the first snapshot."""
+    try:
+        return (Path(SNAPSHOT_DIR) / "CURRENT").read_text().strip() or None
+    except FileNotFoundError:
+        return None
+
+def current_snapshot(meta_dir=META_DIR):
+    """The published snapshot; before the first one, the flat layout of earlier releases (version None)."""
+    version = current_version()
+    if version is None:
+        return Snapshot(None, FAISS_DIR, BM25_DIR, meta_dir)
+    return Snapshot.at(Path(SNAPSHOT_DIR) / version)
+
+def _versions():
+    return sorted(int(m.group(1)) for p in Path(SNAPSHOT_DIR).iterdir() if (m := _VERSION.fullmatch(p.name)))
+
+def new_snapshot():
+    """Empty directory for the next version (call under writer_lock)."""
+    path = Path(SNAPSHOT_DIR) / f"v{max(_versions(), default=0) + 1:06d}"
+    snapshot = Snapshot.at(path)
+    for d in (snapshot.faiss_dir, snapshot.bm25_dir, snapshot.meta_dir):
+        d.mkdir(parents=True, exist_ok=True)
+    return snapshot
+
+def discard(snapshot):
+    shutil.rmtree(snapshot.path, ignore_errors=True)
+
+def publish(snapshot, keep=SNAPSHOT_KEEP):
+    """Atomically make snapshot the current one, then drop all but the `keep` newest versions."""
+    tmp = Path(SNAPSHOT_DIR) / "CURRENT.tmp"
+    tmp.write_text(snapshot.version)
+    os.replace(tmp, Path(SNAPSHOT_DIR) / "CURRENT")
+    gc(keep)
+
+def gc(keep=SNAPSHOT_KEEP):
+    """
+    Remove old snapshots, keeping the `keep` newest and the current one. Readers still
+    holding an older one keep working: its files stay open or mapped until released.
+    """
+    current = current_version()
+    for v in _versions()[:-max(keep, 1)]:
+        name = f"v{v:06d}"
+        if name != current:
+            shutil.rmtree(Path(SNAPSHOT_DIR) / name, ignore_errors=True)
+
+@contextmanager
+def writer_lock():
+    """One writer at a time across threads and processes: each new snapshot builds on the current one."""
+    with _writer_lock, file_lock(Path(SNAPSHOT_DIR) / "writer.lock"):
+        yield
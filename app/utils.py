@@ -1,14 +1,69 @@
-import uuid, os, json, math
+import uuid, os, json, math, hashlib, queue, threading
+from contextlib import contextmanager
 from datetime import datetime
 from .config import LOG_DIR
 from pathlib import Path
 from tqdm import tqdm
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: callers rely on their in-process lock only
+    fcntl = None
 
 LOG_DIR.mkdir(parents=True, exist_ok=True)
 
 def make_id(prefix="c"):
     return f"{prefix}_{uuid.uuid4().hex[:12]}"
 
+def stable_id(prefix, *parts):
+    """Deterministic id derived from the given parts (same inputs -> same id on every run)."""
+    key = "\x1f".join(str(p) for p in parts)
+    return f"{prefix}_{hashlib.sha256(key.encode('utf-8')).hexdigest()[:16]}"
+
+def text_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def content_hash(data):
+    """sha256 hex digest of raw bytes (e.g. an uploaded PDF)."""
+    return hashlib.sha256(data).hexdigest()
+
+def prefetch(iterable, maxsize):
+    """
+    Iterate over iterable in a background thread, keeping at most maxsize items buffered,
+    so the producer (e.g. PDF parsing) overlaps with the consumer (e.g. embedding).
+    Exceptions raised by the producer are re-raised in the consumer.
+    """
+    q = queue.Queue(maxsize=maxsize)
+    done = object()
+    stop = threading.Event()
+
+    def produce():
+        try:
+            for item in iterable:
+                if stop.is_set():
+                    return
+                q.put((item, None))
+        except BaseException as e:
+            q.put((done, e))
+            return
+        q.put((done, None))
+
+    threading.Thread(target=produce, daemon=True).start()
+    try:
+        while True:
+            item, err = q.get()
+            if item is done:
+                if err is not None:
+                    raise err
+                return
+            yield item
+    finally:
+        # consumer stopped early: let the producer exit instead of blocking on a full queue
+        stop.set()
+        while not q.empty():
+            q.get_nowait()
+
 def now_iso():
     return datetime.utcnow().isoformat() + "Z"
 
@@ -17,6 +72,34 @@ def write_json(path, obj):
     with open(path, "w", encoding="utf-8") as f:
         json.dump(obj, f, ensure_ascii=False, indent=2)
 
+def top_k_indices(scores, k):
+    """Indices of the k highest scores, best first, using a partial sort."""
+    n = scores.shape[-1]
+    k = min(k, n)
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    if k < n:
+        idx = np.argpartition(-scores, k - 1)[:k]
+    else:
+        idx = np.arange(n)
+    return idx[np.argsort(-scores[idx], kind="stable")]
+
+@contextmanager
+def file_lock(path):
+    """Exclusive lock across processes on the file at path (created if missing), held until exit."""
+    with open(path, "a") as lock_file:
+        if fcntl:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        yield
+
+def save_npy(path, array):
+    """np.save via a temp file and rename: readers that memory-mapped the previous file keep a valid mapping."""
+    path = Path(path)
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "wb") as f:
+        np.save(f, array, allow_pickle=False)
+    os.replace(tmp, path)
+
 def read_json(path):
     import json
     with open(path, "r", encoding="utf-8") as f:
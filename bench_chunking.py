@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+Chunking Benchmark
+Compares the native RecursiveSplitter with LangChain's RecursiveCharacterTextSplitter
+on large reports: identical boundaries and time per report
+"""
+
+import argparse
+import random
+import time
+from typing import List
+
+from app.chunking import RecursiveSplitter, SEPARATORS
+from app.config import CHUNK_TOKENS, CHUNK_OVERLAP
+
+def synthetic_report(num_pages: int, seed: int = 0) -> List[str]:
+    """Discharge-bundle-like pages: headings, short lines, paragraphs and lab tables"""
+    rng = random.Random(seed)
+    words = ["patient", "admitted", "with", "fever", "hemoglobin", "creatinine", "mg/dL", "normal",
+             "diagnosis", "treatment", "advised", "follow-up", "CT", "scan", "shows", "no", "acute"]
+    pages = []
+    for p in range(num_pages):
+        blocks = [f"DISCHARGE SUMMARY - PAGE {p + 1}"]
+        for _ in range(rng.randint(4, 10)):
+            sentences = [" ".join(rng.choice(words) for _ in range(rng.randint(5, 25))) + "." for _ in range(rng.randint(1, 8))]
+            blocks.append(" ".join(sentences) if rng.random() < 0.6 else "\n".join(sentences))
+        pages.append("\n\n".join(blocks))
+    return pages
+
+def load_pdf_pages(path: str) -> List[str]:
+    from app.pdf_parser import extract_text_pages
+    return [p["text"] for p in extract_text_pages(path)]
+
+def time_splitter(split, pages: List[str], repeat: int):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        out = [split(text) for text in pages]
+        best = min(best, time.perf_counter() - start)
+    return best, out
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark native vs LangChain recursive chunking")
+    parser.add_argument("pdfs", nargs="*", help="PDF reports to chunk (default: synthetic 400-page report)")
+    parser.add_argument("--pages", type=int, default=400, help="Pages in the synthetic report")
+    parser.add_argument("--repeat", type=int, default=3, help="Timing repetitions (best is reported)")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+    import_time = time.perf_counter() - start
+
+    reports = {path: load_pdf_pages(path) for path in args.pdfs} or {f"synthetic ({args.pages} pages)": synthetic_report(args.pages)}
+
+    native = RecursiveSplitter(chunk_size=CHUNK_TOKENS, chunk_overlap=CHUNK_OVERLAP)
+    langchain = RecursiveCharacterTextSplitter(chunk_size=CHUNK_TOKENS, chunk_overlap=CHUNK_OVERLAP, separators=SEPARATORS)
+
+    print(f"langchain.text_splitter import: {import_time * 1000:.0f} ms")
+    for name, pages in reports.items():
+        t_native, out_native = time_splitter(native.split_text, pages, args.repeat)
+        t_lc, out_lc = time_splitter(langchain.split_text, pages, args.repeat)
+        chars = sum(len(p) for p in pages)
+        print("\n" + "=" * 60)
+        print(f"📄 {name}: {len(pages)} pages, {chars:,} characters, {sum(len(o) for o in out_native)} chunks")
+        print(f"   identical boundaries: {'✅' if out_native == out_lc else '❌'}")
+        print(f"   native:    {t_native * 1000:8.1f} ms")
+        print(f"   langchain: {t_lc * 1000:8.1f} ms ({t_lc / t_native:.1f}x)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Worker Memory Report
+Resident memory of the search indices per worker process, with the FAISS index read
+into private memory versus memory-mapped (FAISS_MMAP), or of running uvicorn workers
+"""
+
+import argparse
+import multiprocessing as mp
+from pathlib import Path
+from typing import Dict, List
+
+FIELDS = ("VmRSS", "RssAnon", "RssFile", "Pss")
+
+def memory_kb(pid="self") -> Dict[str, int]:
+    """VmRSS and its anonymous/file-backed split from /proc status, Pss from smaps_rollup (kB)"""
+    out = {}
+    for line in Path(f"/proc/{pid}/status").read_text().splitlines():
+        key = line.split(":")[0]
+        if key in FIELDS:
+            out[key] = int(line.split()[1])
+    # Pss splits shared pages between the processes mapping them: the sum over workers is what the node pays
+    rollup = Path(f"/proc/{pid}/smaps_rollup")
+    if rollup.exists():
+        for line in rollup.read_text().splitlines():
+            if line.startswith("Pss:"):
+                out["Pss"] = int(line.split()[1])
+    return out
+
+def worker(mmap: bool, num_queries: int, loaded, done, results):
+    import numpy as np
+    from app.indexer import read_faiss_index
+    from app.bm25_search import load_bm25
+
+    base = memory_kb()
+    index = read_faiss_index(mmap=mmap)
+    bm25, _ = load_bm25()
+    # touch the index the way queries do, so mapped pages are actually resident
+    rng = np.random.RandomState(0)
+    queries = rng.randn(num_queries, index.d).astype(np.float32)
+    index.search(queries, 16)
+    for _ in range(num_queries):
+        bm25.get_scores([bm25.vocab[int(i)] for i in rng.randint(len(bm25.vocab), size=5)])
+    # measure while every worker holds its indices, so shared pages are split between them
+    loaded.wait()
+    now = memory_kb()
+    results.put({k: now.get(k, 0) - base.get(k, 0) for k in FIELDS})
+    done.wait()
+
+def simulate(workers: int, mmap: bool, num_queries: int) -> List[Dict[str, int]]:
+    ctx = mp.get_context("spawn")
+    loaded, done, results = ctx.Barrier(workers), ctx.Barrier(workers + 1), ctx.Queue()
+    procs = [ctx.Process(target=worker, args=(mmap, num_queries, loaded, done, results)) for _ in range(workers)]
+    for p in procs:
+        p.start()
+    rows = [results.get() for _ in procs]
+    done.wait()
+    for p in procs:
+        p.join()
+    return rows
+
+def print_rows(title: str, rows: List[Dict[str, int]], labels: List[str]) -> None:
+    print("\n" + "=" * 60)
+    print(title)
+    print("=" * 60)
+    print(f"{'Worker':<10} " + " ".join(f"{f + ' MB':<12}" for f in FIELDS))
+    print("-" * 60)
+    for label, row in zip(labels, rows):
+        print(f"{label:<10} " + " ".join(f"{row.get(f, 0) / 1024:<12.1f}" for f in FIELDS))
+    print(f"{'total':<10} " + " ".join(f"{sum(r.get(f, 0) for r in rows) / 1024:<12.1f}" for f in FIELDS))
+
+def main():
+    parser = argparse.ArgumentParser(description="Resident memory per worker: private vs memory-mapped FAISS index")
+    parser.add_argument("--workers", type=int, default=4, help="Worker processes to simulate")
+    parser.add_argument("--queries", type=int, default=64, help="Warm-up queries per worker")
+    parser.add_argument("--pids", type=int, nargs="+", help="Report running worker processes instead (e.g. uvicorn workers)")
+    args = parser.parse_args()
+
+    if args.pids:
+        print_rows("🧠 Running workers (whole process)", [memory_kb(pid) for pid in args.pids], [str(p) for p in args.pids])
+        return
+
+    labels = [f"#{i}" for i in range(args.workers)]
+    before = simulate(args.workers, mmap=False, num_queries=args.queries)
+    after = simulate(args.workers, mmap=True, num_queries=args.queries)
+    print_rows("🧠 FAISS_MMAP=0: index read into private memory (growth after loading indices)", before, labels)
+    print_rows("🧠 FAISS_MMAP=1: index memory-mapped from the page cache (growth after loading indices)", after, labels)
+    saved = sum(r.get("Pss", 0) for r in before) - sum(r.get("Pss", 0) for r in after)
+    print(f"\n✅ Node memory (sum of Pss) saved by FAISS_MMAP=1: {saved / 1024:.1f} MB")
+
+if __name__ == "__main__":
+    main()
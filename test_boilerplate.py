@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""
+Tests for header/footer boilerplate stripping (app.pdf_parser.strip_boilerplate)
+"""
+
+from app.pdf_parser import strip_boilerplate
+
+LETTERHEAD = ["St. Mary's Hospital - Nephrology", "Patient: J. Doe   MRN 004512"]
+FOOTER = ["Confidential medical record"]
+LAB_SHEET = [
+    "Potassium 5.9 mmol/L (HIGH)",
+    "Creatinine 412 umol/L (HIGH)",
+    "eGFR 11 mL/min/1.73m2",
+    "Hemoglobin 9.8 g/dL (LOW)",
+]
+
+def make_pages(bodies, letterhead=True):
+    pages = []
+    for i, body in enumerate(bodies, 1):
+        lines = (LETTERHEAD if letterhead else []) + body + ([f"Page {i} of {len(bodies)}"] + FOOTER if letterhead else [])
+        pages.append({"page_index": i, "page_id": f"p{i}", "text": "\n".join(lines)})
+    return pages
+
+def test_repeated_lab_sheet_is_kept():
+    """A lab sheet attached on pages 2-4 is content, not boilerplate; the letterhead and footer are"""
+    bodies = [["Discharge summary", "Admitted with CKD stage 4", "Plan: start dialysis work-up"]] + [LAB_SHEET] * 3
+    pages, stats = strip_boilerplate(make_pages(bodies))
+    text = "\n".join(p["text"] for p in pages)
+    assert len(pages) == 4
+    for line in LAB_SHEET + ["Discharge summary", "Admitted with CKD stage 4"]:
+        assert line in text, line
+    for line in LETTERHEAD + FOOTER + ["Page 2 of 4"]:
+        assert line not in text, line
+    assert all(p["text"].count("Potassium 5.9 mmol/L (HIGH)") == 1 for p in pages[1:])
+    assert stats["lines_removed"] == 4 * 4
+
+def test_lab_sheet_without_letterhead_is_kept():
+    """Pages holding only the repeated lab sheet (every line a header/footer candidate) keep it"""
+    pages, stats = strip_boilerplate(make_pages([["Discharge summary", "Seen in clinic"]] + [LAB_SHEET] * 3, letterhead=False))
+    assert all("Potassium 5.9 mmol/L (HIGH)" in p["text"] for p in pages[1:])
+    assert stats["lines_removed"] == 0
+
+def test_identical_pages_are_not_emptied():
+    """A document whose pages are all the same is left as is (chunk dedup keeps one copy)"""
+    original = make_pages([LAB_SHEET] * 5, letterhead=False)
+    pages, stats = strip_boilerplate(original)
+    assert [p["text"] for p in pages] == [p["text"] for p in original]
+    assert stats["chars_removed"] == 0
+
+if __name__ == "__main__":
+    for test in (test_repeated_lab_sheet_is_kept, test_lab_sheet_without_letterhead_is_kept, test_identical_pages_are_not_emptied):
+        test()
+        print(f"✅ {test.__name__}")
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+HNSW efSearch Tuning
+Sweeps efSearch on the persisted index (or a synthetic one) against exact flat-scan
+ground truth and reports recall@k versus per-query latency
+"""
+
+import argparse
+import random
+import time
+from typing import List
+
+import faiss
+import numpy as np
+
+from app.config import TOP_K_DENSE, HNSW_M, HNSW_EF_CONSTRUCTION
+
+def corpus_vectors(num_queries: int, queries_file: str, seed: int):
+    """Persisted HNSW index, its spec, exact corpus vectors (row = label) and query vectors"""
+    from app.corpus import load_corpus
+    from app.indexer import load_faiss, load_index_meta, _encode
+
+    index, model, _ = load_faiss()
+    spec = load_index_meta()
+    chunks, _ = load_corpus()
+    assert index.ntotal == len(chunks), "Index is out of sync with the corpus. Rebuild index first."
+    # exact vectors come from the embedding cache, not from the (possibly quantized) index
+    vectors = _encode(model, [c["text"] for c in chunks], show_progress_bar=False)
+
+    if queries_file:
+        with open(queries_file, encoding="utf-8") as f:
+            queries = [line.strip() for line in f if line.strip()]
+    else:
+        # no query log: use the opening words of random chunks as queries
+        rng = random.Random(seed)
+        sample = rng.sample(chunks, min(num_queries, len(chunks)))
+        queries = [" ".join(c["text"].split()[:16]) for c in sample]
+    q = model.encode(queries, convert_to_numpy=True).astype(np.float32)
+    return index, spec, vectors, q
+
+def synthetic_vectors(n: int, dim: int, num_queries: int, seed: int):
+    """Clustered random unit vectors, closer to real embeddings than uniform noise"""
+    rng = np.random.RandomState(seed)
+    centers = rng.randn(max(1, n // 200), dim).astype(np.float32)
+    x = centers[rng.randint(len(centers), size=n)] + 0.5 * rng.randn(n, dim).astype(np.float32)
+    x /= np.linalg.norm(x, axis=1, keepdims=True)
+    q = x[rng.choice(n, num_queries, replace=False)] + 0.1 * rng.randn(num_queries, dim).astype(np.float32)
+
+    from app.indexer import index_spec, _new_index
+    spec = index_spec("hnsw", dim, n)
+    print(f"Building synthetic {spec['factory']} over {n:,} x {dim} vectors (efConstruction={HNSW_EF_CONSTRUCTION})...")
+    index = _new_index(spec, dim)
+    index.add_with_ids(x, np.arange(n, dtype=np.int64))
+    return index, spec, x, q.astype(np.float32)
+
+def sweep(index, spec, vectors: np.ndarray, queries: np.ndarray, k: int, ef_values: List[int]):
+    from app.indexer import search_params
+
+    exact = faiss.IndexFlatL2(vectors.shape[1])
+    exact.add(np.ascontiguousarray(vectors, dtype=np.float32))
+    _, truth = exact.search(queries, k)
+
+    rows = []
+    for ef in ef_values:
+        params = search_params(spec, ef_search=ef)
+        latencies, hits = [], 0
+        # one query per call, as the service searches
+        for i in range(len(queries)):
+            start = time.perf_counter()
+            _, found = index.search(queries[i:i + 1], k, params=params)
+            latencies.append(time.perf_counter() - start)
+            hits += len(set(found[0].tolist()) & set(truth[i].tolist()) - {-1})
+        ms = np.array(latencies) * 1000
+        rows.append((ef, hits / truth.size, ms.mean(), np.percentile(ms, 50), np.percentile(ms, 95)))
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweep HNSW efSearch: recall@k vs latency")
+    parser.add_argument("--ef", type=int, nargs="+", default=[16, 32, 64, 128, 256, 512], help="efSearch values to try")
+    parser.add_argument("--k", type=int, default=TOP_K_DENSE, help="Neighbours per query (recall@k)")
+    parser.add_argument("--queries", help="Text file with one query per line (default: sampled chunk openings)")
+    parser.add_argument("--num-queries", type=int, default=200, help="Queries to sample when --queries is not given")
+    parser.add_argument("--synthetic", type=int, metavar="N", help="Tune on a synthetic N-vector index instead of the persisted one")
+    parser.add_argument("--dim", type=int, default=768, help="Dimension of the synthetic vectors")
+    parser.add_argument("--target", type=float, default=0.95, help="Recall to recommend the smallest efSearch for")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.synthetic:
+        index, spec, vectors, queries = synthetic_vectors(args.synthetic, args.dim, args.num_queries, args.seed)
+    else:
+        index, spec, vectors, queries = corpus_vectors(args.num_queries, args.queries, args.seed)
+    if not spec["index_type"].startswith("hnsw"):
+        print(f"❌ Index type is {spec['index_type']}: efSearch only applies to HNSW indices")
+        return
+
+    rows = sweep(index, spec, vectors, queries, args.k, args.ef)
+
+    print("\n" + "=" * 60)
+    print(f"🔍 {spec['factory']}: {index.ntotal:,} vectors, {len(queries)} queries, k={args.k}")
+    print("=" * 60)
+    print(f"{'efSearch':<10} {'Recall@k':<10} {'Mean ms':<10} {'p50 ms':<10} {'p95 ms':<10}")
+    print("-" * 50)
+    for ef, recall, mean, p50, p95 in rows:
+        print(f"{ef:<10} {recall:<10.4f} {mean:<10.3f} {p50:<10.3f} {p95:<10.3f}")
+
+    reaching = [r for r in rows if r[1] >= args.target]
+    if reaching:
+        print(f"\n✅ Smallest efSearch with recall@{args.k} >= {args.target}: {reaching[0][0]} (set HNSW_EF_SEARCH or pass ef_search)")
+    else:
+        print(f"\n⚠️  No efSearch reached recall@{args.k} >= {args.target}; try larger values or a larger HNSW_M (now {HNSW_M})")
+
+if __name__ == "__main__":
+    main()